@@ -0,0 +1,394 @@
+"""Offline benchmarks for spotify_top_artists.py against a local stand-in Spotify server.
+
+Usage:
+  python benchmark.py [--iterations N] [--latency SECONDS] [--rate-limit-chance P]
+                      [--payload-size N] [--playlists N] [--scenario NAME ...]
+  python benchmark.py --startup [--iterations N]
+
+Every request goes to a mock server on localhost, so no credentials or network
+are needed. For each scenario the report shows how many requests one run makes
+(to catch N+1 regressions), p50/p95 latency per run and throughput.
+
+--startup instead times fresh interpreter processes importing the module and
+running the CLI without a command, next to a bare interpreter for reference,
+and lists which heavy dependencies a plain import pulled in.
+"""
+import argparse
+import builtins
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import spotify_top_artists as spotify
+
+
+class MockSpotify:
+    """Settings and request counters shared by the mock server's handlers"""
+
+    def __init__(self, latency=0.0, rate_limit_chance=0.0, payload_size=10, playlist_count=120,
+                 artist_pool=200):
+        self.latency = latency
+        self.rate_limit_chance = rate_limit_chance
+        self.payload_size = payload_size
+        self.playlist_count = playlist_count
+        self.artist_pool = artist_pool
+        self.requests = Counter()
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.rate_limited = 0
+
+    def artist_id(self, i):
+        # 22 characters, like a real Spotify ID
+        return f"{i % self.artist_pool:022d}"
+
+    def artist(self, artist_id):
+        i = int(artist_id) if artist_id.isdigit() else 0
+        return {
+            'id': artist_id,
+            'name': f"Artist {i}",
+            'type': 'artist',
+            'popularity': (i * 37) % 101,
+            'followers': {'total': i * 1000},
+            'genres': ['pop', 'indie'][: 1 + i % 2],
+            'images': [{'url': f"https://i.example/{artist_id}/{size}", 'height': size, 'width': size}
+                       for size in (640, 320, 160)],
+            'external_urls': {'spotify': f"https://open.spotify.com/artist/{artist_id}"},
+            # Padding that real responses carry and the script never reads
+            'available_markets': ['US'] * self.payload_size,
+        }
+
+    def track(self, artist_id, n):
+        return {
+            'id': f"{artist_id[:18]}{n:04d}",
+            'name': f"Track {n}",
+            'popularity': 50 + n,
+            'duration_ms': 180000 + n,
+            'preview_url': None,
+            'external_urls': {'spotify': f"https://open.spotify.com/track/{n}"},
+            'artists': [{'id': artist_id, 'name': f"Artist {artist_id}"}],
+            'album': self.album(artist_id, n),
+            'available_markets': ['US'] * self.payload_size,
+        }
+
+    def album(self, artist_id, n):
+        return {
+            'id': f"{artist_id[:18]}{n:04d}",
+            'name': f"Album {n}",
+            'release_date': '2024-01-01',
+            'images': [{'url': f"https://i.example/album/{n}"}],
+            'external_urls': {'spotify': f"https://open.spotify.com/album/{n}"},
+            'artists': [{'id': artist_id, 'name': f"Artist {int(artist_id)}"}],
+            'available_markets': ['US'] * self.payload_size,
+        }
+
+    def page(self, base_url, path, items_for, total, offset, limit):
+        items = [items_for(i) for i in range(offset, min(offset + limit, total))]
+        next_url = None
+        if offset + limit < total:
+            next_url = f"{base_url}{path}?offset={offset + limit}&limit={limit}"
+        return {'items': items, 'total': total, 'offset': offset, 'limit': limit, 'next': next_url}
+
+
+def make_handler(mock):
+    """Build a request handler class bound to a MockSpotify"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately; don't let Nagle delay the body
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def maybe_throttle(self):
+            if mock.latency:
+                time.sleep(mock.latency)
+            if mock.rate_limit_chance and random.random() < mock.rate_limit_chance:
+                with mock._lock:
+                    mock.rate_limited += 1
+                self.send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                               {'Retry-After': '0'})
+                return True
+            return False
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            mock.record('POST api/token')
+            if self.maybe_throttle():
+                return
+            self.send_json(200, {'access_token': f"mock-{time.time()}", 'token_type': 'Bearer',
+                                 'expires_in': 3600, 'scope': spotify.SCOPE})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            path = url.path[len('/v1/'):]
+            base_url = f"http://{self.headers['Host']}/v1/"
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', 20))
+
+            # Record the endpoint template, not the concrete IDs
+            template = re.sub(r'^(artists|playlists)/[^/]+', r'\1/{id}', path)
+            mock.record(f"GET {template}")
+            if self.maybe_throttle():
+                return
+
+            if path == 'browse/new-releases':
+                albums = [mock.album(mock.artist_id(i * 3), i) for i in range(limit)]
+                for i, album in enumerate(albums):
+                    album['artists'].append({'id': mock.artist_id(i * 3 + 1), 'name': 'Featured'})
+                self.send_json(200, {'albums': {'items': albums, 'total': limit, 'next': None}})
+            elif path == 'artists':
+                ids = query.get('ids', '').split(',')
+                self.send_json(200, {'artists': [mock.artist(i) for i in ids if i]})
+            elif path == 'search':
+                artists = [mock.artist(mock.artist_id(i)) for i in range(limit)]
+                self.send_json(200, {'artists': {'items': artists, 'total': limit, 'next': None}})
+            elif path == 'me':
+                self.send_json(200, {'id': 'mock-user', 'display_name': 'Mock User'})
+            elif path == 'me/playlists':
+                def playlist(i):
+                    return {'id': f"{i:022d}", 'name': f"Playlist {i}", 'public': True,
+                            'collaborative': False, 'images': [],
+                            'tracks': {'total': 250, 'href': ''}}
+                self.send_json(200, mock.page(base_url, path, playlist, mock.playlist_count, offset, limit))
+            elif template == 'artists/{id}':
+                self.send_json(200, mock.artist(path.split('/')[1]))
+            elif template == 'artists/{id}/top-tracks':
+                artist_id = path.split('/')[1]
+                self.send_json(200, {'tracks': [mock.track(artist_id, n) for n in range(10)]})
+            elif template == 'artists/{id}/related-artists':
+                artist_id = path.split('/')[1]
+                base = int(artist_id) if artist_id.isdigit() else 0
+                self.send_json(200, {'artists': [mock.artist(mock.artist_id(base + n + 1)) for n in range(20)]})
+            elif template == 'artists/{id}/albums':
+                artist_id = path.split('/')[1]
+                self.send_json(200, mock.page(base_url, path, lambda n: mock.album(artist_id, n), 30, offset, limit))
+            elif template == 'playlists/{id}/tracks':
+                artist_id = mock.artist_id(0)
+                def item(n):
+                    return {'added_at': '2024-01-01T00:00:00Z', 'track': mock.track(artist_id, n)}
+                self.send_json(200, mock.page(base_url, path, item, 250, offset, limit))
+            else:
+                self.send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+    return Handler
+
+
+def start_server(mock):
+    """Start the mock server on a free port and point the script at it"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    spotify.API_BASE_URL = f"http://{host}:{port}/v1/"
+    spotify.TOKEN_URL = f"http://{host}:{port}/api/token"
+    return server
+
+
+def write_token_file(path, expires_in):
+    with open(path, 'w') as f:
+        json.dump({'access_token': 'mock-token', 'refresh_token': 'mock-refresh',
+                   'expires_at': int(time.time()) + expires_in}, f)
+
+
+def scenario_popular_artists(token):
+    spotify.get_popular_artists(token)
+
+
+def scenario_search_artist(token):
+    # Always pick the first match instead of prompting
+    original_input = builtins.input
+    builtins.input = lambda prompt='': '1'
+    try:
+        spotify.search_artist(token, 'Artist')
+    finally:
+        builtins.input = original_input
+
+
+def scenario_user_playlists(token):
+    spotify.get_user_playlists(token)
+
+
+def scenario_token_refresh(token):
+    # An expired token on disk forces the refresh path
+    write_token_file(spotify.TOKEN_FILE, expires_in=-1)
+    spotify.get_valid_token()
+
+
+SCENARIOS = {
+    'popular_artists': scenario_popular_artists,
+    'search_artist': scenario_search_artist,
+    'user_playlists': scenario_user_playlists,
+    'token_refresh': scenario_token_refresh,
+}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_scenario(mock, name, iterations):
+    """Run one scenario iterations times and return its measurements"""
+    mock.reset()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        # Each run starts like a fresh process, without artists remembered from the last one
+        spotify.object_memo.clear()
+        run_started = time.perf_counter()
+        # The script prints progress on every call; keep the report readable
+        with redirect_stdout(io.StringIO()):
+            SCENARIOS[name]('mock-token')
+        timings.append(time.perf_counter() - run_started)
+    elapsed = time.perf_counter() - started
+    total_requests = sum(mock.requests.values())
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'requests_per_run': total_requests / iterations,
+        'requests': dict(mock.requests),
+        'rate_limited': mock.rate_limited,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'runs_per_s': iterations / elapsed if elapsed else 0,
+    }
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Commands timed by --startup; 'python' is the interpreter's own startup cost
+STARTUP_COMMANDS = {
+    'python': [sys.executable, '-c', 'pass'],
+    'import': [sys.executable, '-c', 'import spotify_top_artists'],
+    'usage': [sys.executable, 'spotify_top_artists.py'],
+    'command_help': [sys.executable, 'spotify_top_artists.py', 'bulk-search', '--help'],
+}
+
+# Dependencies that only the commands talking to Spotify should load
+HEAVY_MODULES = ('requests', 'aiohttp', 'asyncio', 'dotenv', 'webbrowser')
+
+
+def run_startup(name, iterations):
+    """Start one STARTUP_COMMANDS entry iterations times and return its wall-clock timings"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        subprocess.run(STARTUP_COMMANDS[name], cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - started)
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+    }
+
+
+def imported_heavy_modules():
+    """Heavy dependencies loaded by a plain import of the module"""
+    code = ('import sys, spotify_top_artists; '
+            f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], cwd=SCRIPT_DIR, capture_output=True,
+                            text=True, check=True).stdout.strip()
+    return output.split(',') if output else []
+
+
+def print_startup_report(results, heavy):
+    print(f"{'command':<18}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}")
+    for r in results:
+        print(f"{r['scenario']:<18}{r['iterations']:>6}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}")
+    print()
+    print(f"heavy modules loaded by import: {', '.join(heavy) or 'none'}")
+
+
+def print_report(results):
+    print(f"{'scenario':<18}{'runs':>6}{'req/run':>10}{'429s':>7}{'p50 ms':>10}{'p95 ms':>10}{'runs/s':>10}")
+    for r in results:
+        print(f"{r['scenario']:<18}{r['iterations']:>6}{r['requests_per_run']:>10.1f}{r['rate_limited']:>7}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['runs_per_s']:>10.1f}")
+    print()
+    for r in results:
+        per_endpoint = ', '.join(f"{endpoint} x{count / r['iterations']:g}"
+                                 for endpoint, count in sorted(r['requests'].items()))
+        print(f"{r['scenario']}: {per_endpoint}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20, help='runs per scenario')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to every mock response')
+    parser.add_argument('--rate-limit-chance', type=float, default=0.0,
+                        help='probability that a request is answered with 429')
+    parser.add_argument('--payload-size', type=int, default=10,
+                        help='padding entries per object, to mimic large responses')
+    parser.add_argument('--playlists', type=int, default=120, help='playlists in the mock account')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable, default: all)')
+    parser.add_argument('--startup', action='store_true',
+                        help='time process startup (import, usage) instead of the API scenarios')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    if args.startup:
+        results = [run_startup(name, args.iterations) for name in STARTUP_COMMANDS]
+        heavy = imported_heavy_modules()
+        if args.json:
+            print(json.dumps({'startup': results, 'heavy_modules_on_import': heavy}, indent=2))
+        else:
+            print_startup_report(results, heavy)
+        return
+
+    mock = MockSpotify(args.latency, args.rate_limit_chance, args.payload_size, args.playlists)
+    server = start_server(mock)
+    workdir = tempfile.mkdtemp(prefix='spotify-bench-')
+    spotify.TOKEN_FILE = os.path.join(workdir, 'access_token.json')
+    write_token_file(spotify.TOKEN_FILE, expires_in=3600)
+    # Measure the API traffic itself, not the response cache or the client-side rate limiter
+    spotify.api_client.cache = None
+    spotify.api_client.rate_limiter = None
+
+    try:
+        results = [run_scenario(mock, name, args.iterations) for name in (args.scenario or SCENARIOS)]
+    finally:
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,784 @@
-import requests
 import base64
+import codecs
+import csv
+import heapq
 import json
-import webbrowser
+import math
 import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from array import array
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import redirect_stdout
+from copy import copy
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
 from urllib.parse import urlencode
-from dotenv import load_dotenv
 
-# Load environment variables from .env
-load_dotenv()
-CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
-CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
-REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI')
+# requests, aiohttp, asyncio, webbrowser and python-dotenv are imported where they
+# are first needed: printing usage or importing this module loads none of them.
 
 # Spotify API endpoints
 AUTH_URL = 'https://accounts.spotify.com/authorize'
 TOKEN_URL = 'https://accounts.spotify.com/api/token'
 API_BASE_URL = 'https://api.spotify.com/v1/'
 
+# Maximum number of IDs accepted by the multi-artist endpoint
+ARTISTS_BATCH_SIZE = 50
+
 # Define the scope of permissions we need
 SCOPE = 'user-read-private user-read-email playlist-read-private playlist-read-collaborative'
 
 # File to save the access token
 TOKEN_FILE = 'access_token.json'
 
+# Refresh the access token this many seconds before it actually expires
+TOKEN_EXPIRY_MARGIN = 60
+
+# Serializes token refreshes so concurrent workers don't all hit the token endpoint
+_token_lock = threading.Lock()
+
+# Saved artist records: the JSON file the SQLite store replaces (migrated on first use)
+SAVED_ARTISTS_JSON = 'saved_artists.json'
+
+# Columnar export of saved artists: output directory, and the flat tables it writes as
+# (column, type) pairs. Types are pyarrow type names; CSV files use the same columns.
+COLUMNAR_EXPORT_DIR = 'artists_export'
+COLUMNAR_FORMATS = ('parquet', 'arrow', 'csv')
+COLUMNAR_TABLES = {
+    'artists': [
+        ('artist_id', 'string'), ('name', 'string'), ('popularity', 'int32'), ('followers', 'int64'),
+        ('genres', 'string'), ('image_url', 'string'), ('spotify_url', 'string'), ('updated_at', 'float64'),
+    ],
+    'top_tracks': [
+        ('artist_id', 'string'), ('rank', 'int16'), ('track_id', 'string'), ('name', 'string'),
+        ('album', 'string'), ('popularity', 'int32'), ('spotify_url', 'string'), ('preview_url', 'string'),
+        ('updated_at', 'float64'),
+    ],
+    'albums': [
+        ('artist_id', 'string'), ('rank', 'int16'), ('album_id', 'string'), ('name', 'string'),
+        ('release_date', 'string'), ('image_url', 'string'), ('spotify_url', 'string'),
+        ('updated_at', 'float64'),
+    ],
+}
+
+# Incremental new-releases ingestion: checkpoint file and how many IDs it remembers
+RELEASES_CHECKPOINT_FILE = 'releases_checkpoint.json'
+RELEASES_PAGE_SIZE = 50
+CHECKPOINT_MAX_ALBUMS = 5000
+CHECKPOINT_MAX_ARTISTS = 20000
+
+# Background refresh of saved artists: base seconds between refreshes (divided by 4 for
+# popular artists and again for recently viewed ones), and the default request budget
+REFRESH_INTERVAL = 24 * 60 * 60
+REFRESH_POPULARITY = 70
+REFRESH_RECENT_VIEW = 7 * 24 * 60 * 60
+REFRESH_BUDGET = 30
+REFRESH_PERIOD = 15 * 60
+
+# Related-artist graph crawler defaults
+GRAPH_FILE = 'artist_graph.json'
+CRAWL_MAX_DEPTH = 2
+CRAWL_MAX_NODES = 500
+
+# Read size when parsing large paged responses incrementally (see STREAM_JSON)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Local search over saved artists: field weights and the score a match needs
+INDEX_FIELD_WEIGHTS = {'name': 3.0, 'genres': 1.0, 'tracks': 1.0, 'albums': 1.0}
+INDEX_MIN_SCORE = 0.6
+# Trigrams found in more artists than this only contribute their best-weighted, most popular ones as candidates
+INDEX_MAX_POSTINGS = 200
+
+# Playlist track export: page size of the tracks endpoint
+EXPORT_PAGE_SIZE = 100
+EXPORT_FIELDS = ['playlist_id', 'playlist_name', 'position', 'track_id', 'track_name',
+                 'artists', 'album', 'duration_ms', 'added_at']
+# Only ask Spotify for the fields that end up in the export
+EXPORT_TRACK_FIELDS = 'total,items(added_at,track(id,name,duration_ms,album(name),artists(name)))'
+
+# How long (seconds) responses from each endpoint stay fresh; first match wins.
+# Endpoints not listed here (me/..., the token endpoint) are never cached.
+CACHE_TTLS = [
+    ('browse/new-releases', 15 * 60),
+    ('search', 60 * 60),
+    ('artists/*/top-tracks', 6 * 60 * 60),
+    ('artists/*/related-artists', 24 * 60 * 60),
+    ('artists/*/albums', 24 * 60 * 60),
+    ('artists/*', 24 * 60 * 60),
+    ('artists', 24 * 60 * 60),
+]
+
+# Client-side rate limiting window (seconds) for RATE_LIMIT
+RATE_LIMIT_PERIOD = 30
+
+# Long-running jobs: seconds between checkpoint saves and between progress lines
+JOB_CHECKPOINT_INTERVAL = 5
+JOB_PROGRESS_INTERVAL = 2
+
+# Bulk lookups: how to pick an artist from the search results
+MATCH_POLICIES = ('exact-or-popular', 'popular', 'first')
+
+# Artist IDs, artist URIs and open.spotify.com artist links
+ARTIST_ID_PATTERN = re.compile(r'^(?:spotify:artist:|https?://open\.spotify\.com/artist/)?([0-9A-Za-z]{22})(?:\?.*)?$')
+
+# In-memory memo of artist, album and track objects by ID: entries kept and seconds they stay valid
+MEMO_MAX_ITEMS = 20000
+MEMO_TTL = 10 * 60
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def read_settings():
+    """Read the settings that can be overridden from the environment (or .env, see load_settings)"""
+    global CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, POOL_SIZE, MAX_RETRIES, REQUEST_TIMEOUT
+    global DETAIL_TIMEOUTS, ARTIST_STORE_FILE, STREAM_JSON, EXPORT_CONCURRENCY, CACHE_FILE
+    global CACHE_MAX_BYTES, RATE_LIMIT, RATE_LIMIT_FILE, BULK_WORKERS
+    
+    # Spotify app credentials
+    CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
+    CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
+    REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI')
+    
+    # HTTP client settings
+    POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', '10'))
+    MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', '3'))
+    REQUEST_TIMEOUT = float(os.getenv('SPOTIFY_REQUEST_TIMEOUT', '10'))
+    
+    # Per-request timeouts (seconds) for the artist detail lookups in search_artist
+    DETAIL_TIMEOUTS = {
+        'top_tracks': REQUEST_TIMEOUT,
+        'related_artists': REQUEST_TIMEOUT,
+        'albums': REQUEST_TIMEOUT,
+    }
+    
+    # Saved artist records (SQLite store)
+    ARTIST_STORE_FILE = os.getenv('SPOTIFY_ARTIST_STORE', 'saved_artists.sqlite')
+    
+    # Parse the items of large paged responses incrementally instead of loading
+    # whole documents (SPOTIFY_STREAM_JSON=1 or --stream)
+    STREAM_JSON = os.getenv('SPOTIFY_STREAM_JSON') == '1'
+    
+    # Playlist track pages fetched at once by the export
+    EXPORT_CONCURRENCY = int(os.getenv('SPOTIFY_EXPORT_CONCURRENCY', '8'))
+    
+    # On-disk response cache
+    CACHE_FILE = os.getenv('SPOTIFY_CACHE_FILE', 'api_cache.sqlite')
+    CACHE_MAX_BYTES = int(os.getenv('SPOTIFY_CACHE_MAX_BYTES', str(50 * 1024 * 1024)))
+    
+    # Client-side rate limiting: requests allowed per RATE_LIMIT_PERIOD seconds (0 disables it).
+    # With RATE_LIMIT_FILE set, every process using the same file shares one budget.
+    RATE_LIMIT = int(os.getenv('SPOTIFY_RATE_LIMIT', '150'))
+    RATE_LIMIT_FILE = os.getenv('SPOTIFY_RATE_LIMIT_FILE')
+    
+    # Bulk lookups and crawls: worker threads
+    BULK_WORKERS = int(os.getenv('SPOTIFY_BULK_WORKERS', '4'))
+
+read_settings()
+
+class ResponseCache:
+    """SQLite-backed cache of GET responses with per-endpoint TTLs, ETag revalidation and LRU eviction"""
+
+    def __init__(self, path=None, max_bytes=None, ttls=CACHE_TTLS):
+        self.path = path or CACHE_FILE
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttls = ttls
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        # Opened on first use so commands that never cache don't create the file
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, url TEXT, etag TEXT, content_type TEXT, body BLOB,"
+                " size INTEGER, expires_at REAL, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        return self._conn
+
+    def ttl_for(self, url):
+        """TTL for a URL, or None if responses from it shouldn't be cached"""
+        if not url.startswith(API_BASE_URL):
+            return None
+        path = url[len(API_BASE_URL):].split('?', 1)[0]
+        for pattern, ttl in self.ttls:
+            if fnmatch(path, pattern):
+                return ttl
+        return None
+
+    @staticmethod
+    def make_key(method, url, params=None):
+        if params:
+            url = f"{url}?{urlencode(sorted(params.items()))}"
+        return f"{method} {url}"
+
+    def get(self, key):
+        """Return (response, is_fresh, etag) for a cached entry, or None; counts hits and misses"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT url, etag, content_type, body, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            url, etag, content_type, body, expires_at = row
+            is_fresh = time.time() < expires_at
+            if is_fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._db().execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db().commit()
+        return self._build_response(url, content_type, body), is_fresh, etag
+
+    def put(self, key, response, ttl):
+        """Store a 200 response"""
+        body = response.content
+        with self._lock:
+            now = time.time()
+            self._db().execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, response.url, response.headers.get('ETag'), response.headers.get('Content-Type'),
+                 body, len(body), now + ttl, now),
+            )
+            self._evict()
+            self._db().commit()
+
+    def touch(self, key, ttl):
+        """Mark an entry fresh again after a 304 Not Modified"""
+        with self._lock:
+            now = time.time()
+            self._db().execute(
+                "UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?", (now + ttl, now, key)
+            )
+            self._db().commit()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        total = self._db().execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db().execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self._db().execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._db().execute("DELETE FROM responses")
+            self._db().commit()
+            self._db().execute("VACUUM")
+
+    @staticmethod
+    def _build_response(url, content_type, body):
+        import requests
+        from requests.structures import CaseInsensitiveDict
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = body
+        response.headers = CaseInsensitiveDict({'Content-Type': content_type or 'application/json'})
+        return response
+
+class RateLimiter:
+    """Token bucket allowing max_calls per period seconds; callers wait for a token instead of failing.
+
+    Bursts are held to a tenth of the budget and the bucket refills with the
+    rest, so no rolling window of period seconds sees more than max_calls.
+    The bucket normally lives in memory and is shared by all threads. With
+    state_file, it is kept in that file under an exclusive lock so that several
+    processes draw from the same budget.
+    """
+
+    def __init__(self, max_calls, period=RATE_LIMIT_PERIOD, state_file=None):
+        # A full budget as burst plus a period of refill would admit twice max_calls in one window
+        self.capacity = max(1, max_calls // 10)
+        self.rate = max(1, max_calls - self.capacity) / period
+        self.tokens = float(self.capacity)
+        self.updated = time.time()
+        self._lock = threading.Lock()
+        if state_file and fcntl is None:
+            print("File-based rate limiting needs fcntl; limiting this process only.")
+            state_file = None
+        self.state_file = state_file
+
+    def _refill(self, tokens, updated, now):
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def _take(self):
+        """Take a token if one is available; return 0, or the seconds to wait for one"""
+        now = time.time()
+        if self.state_file:
+            return self._take_shared(now)
+        self.tokens = self._refill(self.tokens, self.updated, now)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def _take_shared(self, now):
+        fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = f.read().split()
+                tokens, updated = (float(state[0]), float(state[1])) if len(state) == 2 else (self.capacity, now)
+                tokens = self._refill(tokens, updated, now)
+                wait_for = 0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait_for = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write(f"{tokens} {now}")
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait_for
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self._lock:
+                wait_for = self._take()
+            if not wait_for:
+                return
+            time.sleep(wait_for)
+
+    async def acquire_async(self):
+        """Wait until a request may be sent without blocking the event loop"""
+        while True:
+            with self._lock:
+                wait_for = self._take()
+            if not wait_for:
+                return
+            import asyncio
+            await asyncio.sleep(wait_for)
+
+def retry_delay(attempt, retry_after=None, backoff_factor=0.5, max_backoff=30):
+    """Seconds to wait before retry number attempt + 1, preferring the server's Retry-After"""
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_backoff, backoff_factor * 2 ** attempt))
+
+def response_size(response, request_kwargs):
+    """Bytes received for a response, without reading a streamed body"""
+    if response is None:
+        return 0
+    if request_kwargs.get('stream'):
+        return int(response.headers.get('Content-Length') or 0)
+    return len(response.content)
+
+def endpoint_template(url):
+    """Turn a request URL into an endpoint name without IDs, e.g. 'artists/{id}/top-tracks'"""
+    path = url.split('?', 1)[0]
+    if path.startswith(API_BASE_URL):
+        path = path[len(API_BASE_URL):]
+    elif path == TOKEN_URL:
+        return 'token'
+    return re.sub(r'^(artists|albums|playlists|tracks|users)/[^/]+', r'\1/{id}', path)
+
+class RequestStats:
+    """Aggregated request count, status, latency, bytes, retries and cache use per endpoint"""
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        """Add one request event (as built by SpotifyClient.request)"""
+        key = f"{event['method']} {event['endpoint']}"
+        with self._lock:
+            entry = self.endpoints.setdefault(key, {
+                'requests': 0, 'statuses': Counter(), 'latencies': [],
+                'bytes': 0, 'retries': 0, 'cache_hits': 0,
+            })
+            entry['requests'] += 1
+            entry['statuses'][str(event['status'])] += 1
+            entry['latencies'].append(event['latency'])
+            entry['bytes'] += event['bytes']
+            entry['retries'] += event['retries']
+            if event['cache'] in ('hit', 'revalidated', 'coalesced'):
+                entry['cache_hits'] += 1
+
+    def summary(self):
+        """One row per endpoint, slowest total time first"""
+        rows = []
+        with self._lock:
+            for key, entry in self.endpoints.items():
+                latencies = sorted(entry['latencies'])
+                rows.append({
+                    'endpoint': key,
+                    'requests': entry['requests'],
+                    'statuses': dict(entry['statuses']),
+                    'total_s': sum(latencies),
+                    'p50_ms': latencies[len(latencies) // 2] * 1000,
+                    'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+                    'max_ms': latencies[-1] * 1000,
+                    'bytes': entry['bytes'],
+                    'retries': entry['retries'],
+                    'cache_hits': entry['cache_hits'],
+                })
+        return sorted(rows, key=lambda row: row['total_s'], reverse=True)
+
+    def print_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        print("\n===== API REQUEST STATS =====\n")
+        print(f"{'endpoint':<40}{'reqs':>6}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'KB':>9}{'retries':>8}{'cached':>7}  statuses")
+        for row in rows:
+            statuses = ', '.join(f"{status}x{count}" for status, count in sorted(row['statuses'].items()))
+            print(f"{row['endpoint']:<40}{row['requests']:>6}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}"
+                  f"{row['max_ms']:>9.1f}{row['bytes'] / 1024:>9.1f}{row['retries']:>8}{row['cache_hits']:>7}  {statuses}")
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = [
+            "# TYPE spotify_api_requests_total counter",
+            "# TYPE spotify_api_request_seconds_total counter",
+            "# TYPE spotify_api_response_bytes_total counter",
+            "# TYPE spotify_api_retries_total counter",
+            "# TYPE spotify_api_cache_hits_total counter",
+        ]
+        for row in self.summary():
+            method, endpoint = row['endpoint'].split(' ', 1)
+            labels = f'method="{method}",endpoint="{endpoint}"'
+            for status, count in row['statuses'].items():
+                lines.append(f'spotify_api_requests_total{{{labels},status="{status}"}} {count}')
+            lines.append(f"spotify_api_request_seconds_total{{{labels}}} {row['total_s']:.6f}")
+            lines.append(f"spotify_api_response_bytes_total{{{labels}}} {row['bytes']}")
+            lines.append(f"spotify_api_retries_total{{{labels}}} {row['retries']}")
+            lines.append(f"spotify_api_cache_hits_total{{{labels}}} {row['cache_hits']}")
+        return "\n".join(lines) + "\n"
+
+class InflightCall:
+    """A GET in progress that concurrent callers asking for the same resource wait on"""
+    __slots__ = ('done', 'response', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+class SpotifyClient:
+    """Shared HTTP client with a pooled keep-alive session, retries and Retry-After handling"""
+
+    def __init__(self, pool_size=None, max_retries=None, timeout=None,
+                 backoff_factor=0.5, max_backoff=30, cache=None):
+        self.pool_size = pool_size or POOL_SIZE
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        # Optional ResponseCache for GET requests; set to None to bypass it
+        self.cache = cache
+        self.timeout = timeout or REQUEST_TIMEOUT
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        # Called with a rejected access token, returns a fresh one (or None)
+        self.on_unauthorized = None
+        # RateLimiter every outgoing request waits on (None for no limit)
+        self.rate_limiter = None
+        # Per-endpoint timings, plus callbacks that receive every request event
+        self.stats = RequestStats()
+        self.hooks = []
+        self._session = None
+        self._session_lock = threading.Lock()
+        # GETs currently being sent, so identical concurrent calls share one request
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # Rejected tokens and the ones that replaced them, so long jobs holding an
+        # old token switch to the new one without another 401 on every call
+        self._renewed_tokens = {}
+
+    @property
+    def session(self):
+        """The keep-alive requests.Session, created (and requests imported) on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def auth_headers(self, token):
+        """Headers for calls to the Web API"""
+        return {'Authorization': f'Bearer {token}'}
+
+    def basic_auth_headers(self):
+        """Headers for calls to the accounts token endpoint"""
+        auth_header = base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode()).decode()
+        return {
+            'Authorization': f'Basic {auth_header}',
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+
+    def _retry_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt, preferring the server's Retry-After"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        return retry_delay(attempt, retry_after, self.backoff_factor, self.max_backoff)
+
+    def request(self, method, url, token=None, headers=None, revalidate=False, **kwargs):
+        """Send a request, retrying on rate limits, server errors and connection failures.
+
+        GETs to endpoints listed in CACHE_TTLS are served from the cache while fresh
+        and revalidated with If-None-Match once expired (or always, with
+        revalidate=True). If a token is given and the
+        call comes back 401, on_unauthorized is asked for a fresh token and the
+        request is retried once with it. Concurrent identical GETs share one
+        request and its response. Every call is recorded in self.stats and
+        passed to the hooks.
+        """
+        if not url.startswith('http'):
+            url = f"{API_BASE_URL}{url}"
+        kwargs.setdefault('timeout', self.timeout)
+
+        info = {'retries': 0, 'cache': None}
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self._coalesced(method, url, token, headers, kwargs, info, revalidate)
+            return response
+        finally:
+            event = {
+                'method': method,
+                'endpoint': endpoint_template(url),
+                'status': response.status_code if response is not None else 'error',
+                'latency': time.perf_counter() - started,
+                'bytes': response_size(response, kwargs) if info['cache'] not in ('hit', 'coalesced') else 0,
+                'retries': info['retries'],
+                'cache': info['cache'],
+            }
+            self.stats.record(event)
+            for hook in self.hooks:
+                hook(event)
+
+    def _coalesced(self, method, url, token, headers, kwargs, info, revalidate):
+        # Streamed bodies can only be read once, so only buffered GETs are shared
+        if method != 'GET' or headers or kwargs.get('stream'):
+            return self._request(method, url, token, headers, kwargs, info, revalidate)
+
+        key = (ResponseCache.make_key(method, url, kwargs.get('params')), token, revalidate)
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = InflightCall()
+        if not leader:
+            call.done.wait()
+            info['cache'] = 'coalesced'
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = self._request(method, url, token, headers, kwargs, info, revalidate)
+            return call.response
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def _request(self, method, url, token, headers, kwargs, info, revalidate=False):
+        # Streamed responses are consumed incrementally, so they bypass the cache
+        ttl = self.cache.ttl_for(url) if self.cache and method == 'GET' and not kwargs.get('stream') else None
+        if ttl is None:
+            return self._send_authorized(method, url, token, headers, kwargs, info)
+
+        key = self.cache.make_key(method, url, kwargs.get('params'))
+        cached = self.cache.get(key)
+        if cached and cached[1] and not revalidate:
+            info['cache'] = 'hit'
+            return cached[0]
+        info['cache'] = 'miss'
+
+        if cached and cached[2]:
+            # Expired (or revalidation asked for): ask the server whether it changed
+            headers = dict(headers or {}, **{'If-None-Match': cached[2]})
+        response = self._send_authorized(method, url, token, headers, kwargs, info)
+        if response.status_code == 304 and cached:
+            info['cache'] = 'revalidated'
+            self.cache.touch(key, ttl)
+            return cached[0]
+        if response.status_code == 200:
+            self.cache.put(key, response, ttl)
+        return response
+
+    def _send_authorized(self, method, url, token, headers, kwargs, info):
+        while token in self._renewed_tokens:
+            token = self._renewed_tokens[token]
+        response = self._send(method, url, token, headers, kwargs, info)
+        if response.status_code == 401 and token and self.on_unauthorized:
+            new_token = self.on_unauthorized(token)
+            if new_token and new_token != token:
+                self._renewed_tokens[token] = new_token
+                info['retries'] += 1
+                response.close()
+                response = self._send(method, url, new_token, headers, kwargs, info)
+        return response
+
+    def _send(self, method, url, token, headers, kwargs, info):
+        import requests
+        all_headers = self.auth_headers(token) if token else {}
+        all_headers.update(headers or {})
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            if attempt:
+                info['retries'] += 1
+            try:
+                response = self.session.request(method, url, headers=all_headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                print(f"Request to {url} failed ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return response
+            delay = self._retry_delay(attempt, response)
+            print(f"Got status {response.status_code} from {url}, retrying in {delay:.1f}s...")
+            # Give the connection back to the pool (matters for streamed responses)
+            response.close()
+            time.sleep(delay)
+
+    def get(self, url, token=None, **kwargs):
+        return self.request('GET', url, token, **kwargs)
+
+    def post(self, url, token=None, **kwargs):
+        return self.request('POST', url, token, **kwargs)
+
+class ObjectMemo:
+    """Per-process memo of model objects (currently artists) by kind and Spotify ID.
+
+    Objects are stored and handed out as shallow copies, so callers can set
+    details on what they get without affecting each other. Entries expire
+    after ttl seconds and the least recently used go first beyond max_items.
+    """
+
+    def __init__(self, max_items=MEMO_MAX_ITEMS, ttl=MEMO_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, object_id):
+        """The memoized object of a kind (e.g. 'artist') with this ID, or None"""
+        with self._lock:
+            entry = self._items.pop((kind, object_id), None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            # Re-inserting keeps the dict in least-recently-used order
+            self._items[(kind, object_id)] = entry
+            self.hits += 1
+        return copy(entry[1])
+
+    def put(self, kind, objects):
+        """Memoize objects (anything with an id) of one kind"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            for obj in objects:
+                if obj.id:
+                    self._items.pop((kind, obj.id), None)
+                    self._items[(kind, obj.id)] = (expires_at, copy(obj))
+            while len(self._items) > self.max_items:
+                del self._items[next(iter(self._items))]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+# Artists seen by this process, shared by every lookup
+object_memo = ObjectMemo()
+
+def apply_settings(client):
+    """Configure a SpotifyClient from the current settings.
+
+    On a client configured before, only what still holds the value the
+    settings gave it last time is replaced, so hooks, a custom rate limiter
+    or cache=None set since then are kept. The pool size only takes effect
+    if the client hasn't connected yet.
+    """
+    settings = {
+        'pool_size': POOL_SIZE,
+        'max_retries': MAX_RETRIES,
+        'timeout': REQUEST_TIMEOUT,
+        'cache': ResponseCache(),
+        'rate_limiter': RateLimiter(RATE_LIMIT, state_file=RATE_LIMIT_FILE) if RATE_LIMIT else None,
+    }
+    applied = getattr(client, '_settings', None)
+    for name, value in settings.items():
+        if applied is None or getattr(client, name) is applied[name]:
+            setattr(client, name, value)
+    client._settings = settings
+    return client
+
+def make_api_client():
+    """A SpotifyClient configured from the current settings"""
+    client = apply_settings(SpotifyClient())
+    # Requests rejected with 401 refresh the saved token and retry once
+    client.on_unauthorized = lambda stale_token: get_valid_token(stale_token=stale_token)
+    return client
+
+# Single client shared by every API call in this module (it connects on first use)
+api_client = make_api_client()
+
+_settings_loaded = False
+
+def load_settings():
+    """Load .env and apply its settings; only the first call does anything.
+
+    Importing this module reads settings from the process environment only, so
+    library users who rely on a .env file call this once before anything else.
+    The settings are applied to the existing api_client rather than replacing it.
+    """
+    global _settings_loaded
+    if _settings_loaded:
+        return
+    _settings_loaded = True
+    from dotenv import load_dotenv
+    if load_dotenv():
+        read_settings()
+        apply_settings(api_client)
+
 def get_auth_url():
     """Generate the authorization URL for Spotify login"""
     params = {
@@ -37,63 +793,287 @@ def get_auth_url():
 
 def get_token(auth_code):
     """Exchange the authorization code for an access token"""
-    auth_header = base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode()).decode()
-    headers = {
-        'Authorization': f'Basic {auth_header}',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
     data = {
         'grant_type': 'authorization_code',
         'code': auth_code,
         'redirect_uri': REDIRECT_URI
     }
-    response = requests.post(TOKEN_URL, headers=headers, data=data)
-    return response.json()
+    response = api_client.post(TOKEN_URL, headers=api_client.basic_auth_headers(), data=data)
+    return add_token_expiry(response.json())
 
-def get_popular_artists(token, limit=10):
-    """Get globally popular artists from new releases on Spotify"""
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    
-    # Get new album releases
-    print(f"\nRequesting new releases with token: {token[:10]}...")
-    response = requests.get(f"{API_BASE_URL}browse/new-releases?limit=20&country=US", headers=headers)
+def first_image_url(data):
+    """URL of the first (largest) image of a Spotify object, or None"""
+    images = data.get('images') or []
+    return images[0].get('url') if images else None
+
+@dataclass(slots=True)
+class Album:
+    """The album fields the display and saved records use"""
+    id: str
+    name: str
+    release_date: str = None
+    image_url: str = None
+    spotify_url: str = None
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            id=data.get('id'),
+            name=data.get('name'),
+            release_date=data.get('release_date'),
+            image_url=first_image_url(data),
+            spotify_url=data.get('external_urls', {}).get('spotify'),
+        )
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(id=record.get('id'), name=record.get('name'), release_date=record.get('release_date'),
+                   image_url=record.get('image_url'), spotify_url=record.get('spotify_url'))
+
+    def to_record(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "release_date": self.release_date,
+            "image_url": self.image_url,
+            "spotify_url": self.spotify_url
+        }
+
+@dataclass(slots=True)
+class Track:
+    """The track fields the display and saved records use"""
+    id: str
+    name: str
+    popularity: int = None
+    spotify_url: str = None
+    preview_url: str = None
+    album_name: str = None
+    album_image_url: str = None
+
+    @classmethod
+    def from_json(cls, data):
+        album = data.get('album') or {}
+        return cls(
+            id=data.get('id'),
+            name=data.get('name'),
+            popularity=data.get('popularity'),
+            spotify_url=data.get('external_urls', {}).get('spotify'),
+            preview_url=data.get('preview_url'),
+            album_name=album.get('name'),
+            album_image_url=first_image_url(album),
+        )
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(id=record.get('id'), name=record.get('name'), popularity=record.get('popularity'),
+                   spotify_url=record.get('spotify_url'), preview_url=record.get('preview_url'),
+                   album_name=record.get('album'), album_image_url=record.get('album_image_url'))
+
+    def to_record(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "album": self.album_name,
+            "popularity": self.popularity,
+            "spotify_url": self.spotify_url,
+            "preview_url": self.preview_url,
+            "album_image_url": self.album_image_url
+        }
+
+@dataclass(slots=True)
+class Artist:
+    """An artist, plus the details search_artist adds to it.
+
+    related_artists is None when Spotify doesn't provide them for this artist.
+    markets lists where the artist was found by get_popular_artists_for_markets.
+    """
+    id: str
+    name: str
+    popularity: int = None
+    followers: int = None
+    genres: list = field(default_factory=list)
+    image_url: str = None
+    spotify_url: str = None
+    top_tracks: list = field(default_factory=list)
+    albums: list = field(default_factory=list)
+    related_artists: list = field(default_factory=list)
+    concerts: list = field(default_factory=list)
+    markets: list = None
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            id=data.get('id'),
+            name=data.get('name', 'Unknown Artist'),
+            popularity=data.get('popularity'),
+            followers=(data.get('followers') or {}).get('total'),
+            genres=data.get('genres') or [],
+            image_url=first_image_url(data),
+            spotify_url=data.get('external_urls', {}).get('spotify'),
+        )
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild an Artist from a saved minimal record (related artists keep only their names)"""
+        return cls(
+            id=record.get('id'),
+            name=record.get('name'),
+            popularity=record.get('popularity'),
+            followers=record.get('followers'),
+            genres=record.get('genres') or [],
+            image_url=record.get('image_url'),
+            spotify_url=record.get('spotify_url'),
+            top_tracks=[Track.from_record(t) for t in record.get('top_tracks') or []],
+            albums=[Album.from_record(a) for a in record.get('albums') or []],
+            related_artists=[cls(id=None, name=name) for name in record.get('related_artists') or []],
+            concerts=record.get('concerts') or [],
+        )
+
+    def to_record(self):
+        """The minimal record that gets saved for an artist"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "spotify_url": self.spotify_url,
+            "popularity": self.popularity,
+            "followers": self.followers,
+            "genres": self.genres,
+            "image_url": self.image_url,
+            "top_tracks": [track.to_record() for track in self.top_tracks],
+            "albums": [album.to_record() for album in self.albums],
+            "related_artists": [ra.name for ra in (self.related_artists or [])],
+            "concerts": self.concerts
+        }
+
+@dataclass(slots=True)
+class Playlist:
+    """The playlist fields the display and export use"""
+    id: str
+    name: str
+    track_count: int = 0
+    public: bool = None
+    collaborative: bool = False
+    image_url: str = None
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            id=data.get('id'),
+            name=data.get('name') or '',
+            track_count=(data.get('tracks') or {}).get('total', 0),
+            public=data.get('public'),
+            collaborative=data.get('collaborative'),
+            image_url=first_image_url(data),
+        )
+
+def get_several_artists(token, artist_ids, revalidate=False, strict=False):
+    """Get Artist records for a list of artist IDs, batched by ARTISTS_BATCH_SIZE.
+
+    Artists already in object_memo are not requested again. With revalidate=True
+    the memo is skipped and cached batches are checked with Spotify even while fresh.
+    A batch that fails is left out, unless strict, in which case its error is raised.
+    """
+    found = {}
+    if not revalidate:
+        for artist_id in artist_ids:
+            artist = object_memo.get('artist', artist_id)
+            if artist:
+                found[artist_id] = artist
+    missing = list(dict.fromkeys(a for a in artist_ids if a not in found))
+    for start in range(0, len(missing), ARTISTS_BATCH_SIZE):
+        chunk = missing[start:start + ARTISTS_BATCH_SIZE]
+        try:
+            response = api_client.get("artists", token, params={'ids': ','.join(chunk)}, revalidate=revalidate)
+            if response.status_code != 200:
+                print(f"Error getting artist details: {response.json()}")
+                if strict:
+                    response.raise_for_status()
+                continue
+            # Unknown IDs come back as null entries
+            fetched = [Artist.from_json(a) for a in response.json().get('artists', []) if a]
+            object_memo.put('artist', fetched)
+            found.update((artist.id, artist) for artist in fetched)
+        except Exception as e:
+            if strict:
+                raise
+            print(f"Error getting details for artists: {str(e)}")
+    return [found[artist_id] for artist_id in artist_ids if artist_id in found]
+
+def collect_artist_ids(albums, limit):
+    """Unique artist IDs from a list of albums, in order of appearance, at most limit"""
+    artist_ids = []
+    for album in albums:
+        if 'artists' in album:
+            for artist in album['artists']:
+                if artist['id'] not in artist_ids and len(artist_ids) < limit:
+                    artist_ids.append(artist['id'])
+    return artist_ids
+
+def get_new_release_albums(token, country='US'):
+    """Get the first page of new album releases for a market"""
+    print(f"\nRequesting new releases for {country} with token: {token[:10]}...")
+    response = api_client.get("browse/new-releases", token, params={'limit': 20, 'country': country})
     print(f"New releases response status code: {response.status_code}")
     
     if response.status_code != 200:
         print(f"Error getting new releases: {response.json()}")
-        return {"items": []}
+        return []
     
     albums = response.json().get('albums', {}).get('items', [])
     if not albums:
         print("No new releases found")
-        return {"items": []}
+        return []
     
     print(f"Found {len(albums)} new release albums")
-    
-    # Extract unique artists from the albums
+    return albums
+
+def hydrate_artists(token, artist_ids):
+    """Get full details for artist IDs, keyed by ID in the original order"""
+    # Get full artist details in as few requests as possible
     artists = {}
-    for album in albums:
-        if 'artists' in album:
-            for artist in album['artists']:
-                if artist['id'] not in artists and len(artists) < limit:
-                    try:
-                        # Get full artist details
-                        artist_response = requests.get(f"{API_BASE_URL}artists/{artist['id']}", headers=headers)
-                        if artist_response.status_code == 200:
-                            artists[artist['id']] = artist_response.json()
-                            # Use ASCII-only representation for console output
-                            artist_name = artist['name'].encode('ascii', 'replace').decode('ascii')
-                            print(f"Got details for artist: {artist_name}")
-                    except Exception as e:
-                        print(f"Error getting details for an artist: {str(e)}")
+    for artist in get_several_artists(token, artist_ids):
+        artists[artist.id] = artist
+        # Use ASCII-only representation for console output
+        artist_name = artist.name.encode('ascii', 'replace').decode('ascii')
+        print(f"Got details for artist: {artist_name}")
+    return artists
+
+def get_popular_artists(token, limit=10, country='US'):
+    """Get globally popular artists from new releases on Spotify"""
+    albums = get_new_release_albums(token, country)
+    if not albums:
+        return {"items": []}
+    
+    artists = hydrate_artists(token, collect_artist_ids(albums, limit))
     
     # Format the response similar to the top artists endpoint
     result = {"items": list(artists.values())}
     print(f"Found {len(result['items'])} unique artists")
     return result
 
+def get_popular_artists_for_markets(token, markets, limit=10):
+    """Popular artists across several markets, ranked by popularity, then followers.
+
+    New releases for all markets are fetched in parallel; each artist is
+    hydrated once no matter how many markets it appears in, and gets a
+    'markets' list of where it was found.
+    """
+    with ThreadPoolExecutor(max_workers=min(len(markets), BULK_WORKERS * 2) or 1) as executor:
+        albums_by_market = dict(zip(markets, executor.map(lambda m: get_new_release_albums(token, m), markets)))
+    
+    # Merge the artists of all markets, keeping the per-market limit
+    artist_markets = {}
+    for market, albums in albums_by_market.items():
+        for artist_id in collect_artist_ids(albums, limit):
+            artist_markets.setdefault(artist_id, []).append(market)
+    
+    artists = hydrate_artists(token, list(artist_markets))
+    for artist_id, artist in artists.items():
+        artist.markets = artist_markets[artist_id]
+    ranked = sorted(artists.values(), key=lambda a: (a.popularity or 0, a.followers or 0), reverse=True)
+    print(f"Found {len(ranked)} unique artists across {len(markets)} markets")
+    return {"items": ranked}
+
 def display_artists(artists_data):
     """Display the artists information"""
     if 'items' not in artists_data:
@@ -110,14 +1090,16 @@ def display_artists(artists_data):
     for i, artist in enumerate(artists_data['items'], 1):
         try:
             # Use ASCII-only representation for console output
-            artist_name = artist['name'].encode('ascii', 'replace').decode('ascii')
+            artist_name = artist.name.encode('ascii', 'replace').decode('ascii')
             print(f"{i}. {artist_name}")
-            print(f"   Popularity: {artist['popularity']}/100")
-            print(f"   Followers: {artist['followers']['total']:,}")
+            print(f"   Popularity: {artist.popularity}/100")
+            print(f"   Followers: {artist.followers:,}")
+            if artist.markets is not None:
+                print(f"   Markets: {len(artist.markets)} ({', '.join(artist.markets)})")
             
             # Handle genres safely
             genres = []
-            for genre in artist['genres']:
+            for genre in artist.genres:
                 try:
                     genres.append(genre.encode('ascii', 'replace').decode('ascii'))
                 except:
@@ -125,8 +1107,8 @@ def display_artists(artists_data):
             
             print(f"   Genres: {', '.join(genres)}")
             
-            if artist['images']:
-                print(f"   Image: {artist['images'][0]['url']}")
+            if artist.image_url:
+                print(f"   Image: {artist.image_url}")
             print()
         except Exception as e:
             print(f"Error displaying artist {i}: {str(e)}")
@@ -134,6 +1116,7 @@ def display_artists(artists_data):
 
 def show_auth_url():
     """Step 1: Get and display authorization URL for the user to visit"""
+    import webbrowser
     auth_url = get_auth_url()
     print("\nPlease visit this URL to authorize the application:")
     print(auth_url)
@@ -141,7 +1124,7 @@ def show_auth_url():
     print("\nAfter authorizing, you will be redirected to a URL like:")
     print(f"{REDIRECT_URI}?code=AQD...long-code-here...")
     print("\nCopy the entire code parameter value (everything after 'code=') and run:")
-    print("python spotify_top_artists.py --code YOUR_AUTHORIZATION_CODE")
+    print("python spotify_top_artists.py code YOUR_AUTHORIZATION_CODE")
     return True
 
 def process_auth_code(auth_code):
@@ -153,28 +1136,33 @@ def process_auth_code(auth_code):
         return False
     
     # Save the token data to a file
-    with open(TOKEN_FILE, 'w') as f:
-        json.dump(token_data, f)
+    save_token_data(token_data)
     
     print("\nAuthorization successful! Token saved to", TOKEN_FILE)
     return True
 
+def add_token_expiry(token_data):
+    """Record when the access token expires as an absolute timestamp"""
+    if 'expires_in' in token_data:
+        token_data['expires_at'] = int(time.time()) + int(token_data['expires_in'])
+    return token_data
+
+def save_token_data(token_data):
+    """Write the token data to TOKEN_FILE"""
+    with open(TOKEN_FILE, 'w') as f:
+        json.dump(token_data, f)
+
 def refresh_token(refresh_token_str):
     """Refresh the access token using the refresh token"""
-    auth_header = base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode()).decode()
-    headers = {
-        'Authorization': f'Basic {auth_header}',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
     data = {
         'grant_type': 'refresh_token',
         'refresh_token': refresh_token_str
     }
-    response = requests.post(TOKEN_URL, headers=headers, data=data)
-    return response.json()
+    response = api_client.post(TOKEN_URL, headers=api_client.basic_auth_headers(), data=data)
+    return add_token_expiry(response.json())
 
-def get_valid_token():
-    """Get a valid access token, refreshing if necessary"""
+def load_token_data():
+    """Load the saved token data, or None (with a hint) if it is missing or unusable"""
     if not os.path.exists(TOKEN_FILE):
         print("No saved token found. Please run the authorization step first.")
         return None
@@ -187,80 +1175,105 @@ def get_valid_token():
         print("Invalid token data. Please run the authorization step again.")
         return None
     
-    # Check if we have a refresh token
-    if 'refresh_token' in token_data:
-        # Try to use the access token
-        access_token = token_data['access_token']
-        
-        # Make a simple API call to check if the token is still valid
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        response = requests.get(f"{API_BASE_URL}me", headers=headers)
-        
-        # If the token is expired, refresh it
-        if response.status_code == 401:
-            print("Access token expired. Refreshing...")
-            new_token_data = refresh_token(token_data['refresh_token'])
-            
-            if 'access_token' in new_token_data:
-                # Update the access token
-                token_data['access_token'] = new_token_data['access_token']
-                
-                # Update the refresh token if a new one was provided
-                if 'refresh_token' in new_token_data:
-                    token_data['refresh_token'] = new_token_data['refresh_token']
-                
-                # Save the updated token data
-                with open(TOKEN_FILE, 'w') as f:
-                    json.dump(token_data, f)
-                
-                print("Token refreshed successfully!")
-                return token_data['access_token']
-            else:
-                print("Error refreshing token:", new_token_data)
-                return None
-        
-        return access_token
-    else:
+    if 'refresh_token' not in token_data:
         print("No refresh token found. Please run the authorization step again.")
         return None
+    return token_data
+
+def token_needs_refresh(token_data, stale_token=None):
+    """Decide whether the saved access token has to be refreshed"""
+    if stale_token is not None:
+        if stale_token != token_data['access_token']:
+            # Someone else already refreshed it
+            return False
+        print("Access token rejected. Refreshing...")
+        return True
+    if time.time() < token_data.get('expires_at', 0) - TOKEN_EXPIRY_MARGIN:
+        # Still valid; tokens saved without expires_at are refreshed once to get one
+        return False
+    print("Access token expired. Refreshing...")
+    return True
+
+def store_refreshed_token(token_data, new_token_data):
+    """Merge a refresh response into the saved token data; returns the new access token or None"""
+    if 'access_token' not in new_token_data:
+        print("Error refreshing token:", new_token_data)
+        return None
+    
+    # Update the access token and its expiry
+    token_data['access_token'] = new_token_data['access_token']
+    if 'expires_at' in new_token_data:
+        token_data['expires_at'] = new_token_data['expires_at']
+    
+    # Update the refresh token if a new one was provided
+    if 'refresh_token' in new_token_data:
+        token_data['refresh_token'] = new_token_data['refresh_token']
+    
+    # Save the updated token data
+    save_token_data(token_data)
+    
+    print("Token refreshed successfully!")
+    return token_data['access_token']
+
+def get_valid_token(stale_token=None):
+    """Get a valid access token, refreshing if it is expired or about to expire.
 
-def get_popular_artists_with_saved_token():
-    """Use the saved token to get and display popular artists"""
+    Passing the access token that was just rejected with a 401 as stale_token
+    forces a refresh, unless another caller has already replaced it.
+    """
+    # Only one caller at a time may inspect and refresh the token
+    with _token_lock:
+        token_data = load_token_data()
+        if token_data is None:
+            return None
+        if not token_needs_refresh(token_data, stale_token):
+            return token_data['access_token']
+        return store_refreshed_token(token_data, refresh_token(token_data['refresh_token']))
+
+def get_popular_artists_with_saved_token(markets=None):
+    """Use the saved token to get and display popular artists (for one or several markets)"""
     access_token = get_valid_token()
     if not access_token:
         return False
     
     # Get popular artists
-    artists_data = get_popular_artists(access_token)
+    if markets:
+        artists_data = get_popular_artists_for_markets(access_token, markets)
+    else:
+        artists_data = get_popular_artists(access_token)
     
     # Display the artists
     display_artists(artists_data)
     return True
 
-def search_artist(token, query):
-    """Search for an artist by name and allow user to pick the correct one"""
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    
-    # Search for the artist
-    print(f"\nSearching for artist: {query}...")
+def search_artist_candidates(token, query, limit=5, strict=False):
+    """Return the top artist matches for a query, or None on error (with strict, the error is raised)"""
     params = {
         'q': query,
         'type': 'artist',
-        'limit': 5  # Get the top 5 matches
+        'limit': limit
     }
-    response = requests.get(f"{API_BASE_URL}search", headers=headers, params=params)
+    response = api_client.get("search", token, params=params)
     print(f"Search response status code: {response.status_code}")
     
     if response.status_code != 200:
         print(f"Error searching for artist: {response.json()}")
+        if strict:
+            response.raise_for_status()
+        return None
+    artists = [Artist.from_json(a) for a in response.json().get('artists', {}).get('items', []) if a]
+    object_memo.put('artist', artists)
+    return artists
+
+def search_artist(token, query, concurrent=True):
+    """Search for an artist by name and allow user to pick the correct one"""
+    # Search for the artist
+    print(f"\nSearching for artist: {query}...")
+    artists = search_artist_candidates(token, query)
+    if artists is None:
         return None
     
     # Check if we found any artists
-    artists = response.json().get('artists', {}).get('items', [])
     if not artists:
         print(f"No artists found matching '{query}'")
         return None
@@ -268,10 +1281,8 @@ def search_artist(token, query):
     # Show top 5 matches and let user pick
     print("\nTop 5 artist matches:")
     for idx, artist in enumerate(artists, 1):
-        name = artist['name']
-        url = artist['external_urls']['spotify']
-        genres = ', '.join(artist['genres']) if artist['genres'] else 'N/A'
-        print(f"{idx}. {name} | Genres: {genres} | Popularity: {artist['popularity']} | Spotify: {url}")
+        genres = ', '.join(artist.genres) if artist.genres else 'N/A'
+        print(f"{idx}. {artist.name} | Genres: {genres} | Popularity: {artist.popularity} | Spotify: {artist.spotify_url}")
     
     # Get user choice
     while True:
@@ -285,61 +1296,108 @@ def search_artist(token, query):
             print("Please enter a valid number.")
     
     artist = artists[selection-1]
-    artist_id = artist['id']
-    print(f"You selected: {artist['name']} (ID: {artist_id})")
+    print(f"You selected: {artist.name} (ID: {artist.id})")
     
-    # Get the artist's top tracks (limited to 5)
-    print(f"Getting top tracks for {artist['name']}...")
-    response = requests.get(f"{API_BASE_URL}artists/{artist_id}/top-tracks?country=US", headers=headers)
+    return enrich_artist(token, artist, concurrent=concurrent)
+
+def get_artist_top_tracks(token, artist_id, timeout=None, strict=False):
+    """Get an artist's top tracks (limited to 5)"""
+    response = api_client.get(f"artists/{artist_id}/top-tracks", token, params={'country': 'US'},
+                              timeout=timeout or DETAIL_TIMEOUTS['top_tracks'])
     
     if response.status_code != 200:
         print(f"Error getting top tracks: {response.json()}")
-        top_tracks = []
-    else:
-        # Limit to top 5 tracks
-        top_tracks = response.json().get('tracks', [])[:5]
-    
-    # Add top tracks to the artist object
-    artist['top_tracks'] = top_tracks
-    
-    # Get related artists (robust)
-    print(f"Getting related artists for {artist['name']}...")
-    related_url = f"{API_BASE_URL}artists/{artist_id}/related-artists"
+        if strict:
+            response.raise_for_status()
+        return []
+    # Limit to top 5 tracks
+    return [Track.from_json(t) for t in response.json().get('tracks', [])[:5]]
+
+def get_related_artists(token, artist_id, timeout=None, strict=False):
+    """Get an artist's related artists, or None if Spotify doesn't provide them.
+
+    Other errors give an empty list, or are raised with strict.
+    """
     try:
-        related_resp = requests.get(related_url, headers=headers)
+        related_resp = api_client.get(f"artists/{artist_id}/related-artists", token,
+                                      timeout=timeout or DETAIL_TIMEOUTS['related_artists'])
         if related_resp.status_code == 200:
-            related_artists = related_resp.json().get('artists', [])
+            related = [Artist.from_json(a) for a in related_resp.json().get('artists', [])]
+            object_memo.put('artist', related)
+            return related
         elif related_resp.status_code == 404:
             print("Related artists are not available for this artist due to Spotify API limitations.")
-            related_artists = None  # Use None to distinguish this case
+            return None  # Use None to distinguish this case
         else:
             print(f"Error getting related artists: {related_resp.json()}")
-            related_artists = []
+            if strict:
+                related_resp.raise_for_status()
+            return []
     except Exception as e:
+        if strict:
+            raise
         print(f"Exception getting related artists: {e}")
-        related_artists = []
-    artist['related_artists'] = related_artists
-    
-    # Get artist's albums (limited to 2)
-    print(f"Getting albums for {artist['name']}...")
-    albums_url = f"{API_BASE_URL}artists/{artist_id}/albums"
+        return []
+
+def get_artist_albums(token, artist_id, timeout=None, stream=None, strict=False):
+    """Get an artist's albums (limited to 2, deduplicated by name)"""
     albums_params = {'limit': 10, 'include_groups': 'album'}
-    albums_resp = requests.get(albums_url, headers=headers, params=albums_params)
+    stream = STREAM_JSON if stream is None else stream
+    albums_resp = api_client.get(f"artists/{artist_id}/albums", token, params=albums_params,
+                                 timeout=timeout or DETAIL_TIMEOUTS['albums'], stream=stream)
+    if albums_resp.status_code != 200:
+        print(f"Error getting albums: {albums_resp.json()}")
+        if strict:
+            albums_resp.raise_for_status()
+        return []
+    if stream:
+        # Stop reading as soon as two distinct albums have been seen
+        page = StreamedPage(albums_resp)
+        albums = pick_top_albums(page)
+        page.close()
+        return albums
+    return pick_top_albums(albums_resp.json().get('items', []))
+
+def pick_top_albums(items, count=2):
+    """The first count albums, skipping repeated names (e.g. deluxe re-releases)"""
     albums = []
-    if albums_resp.status_code == 200:
-        seen = set()
-        for album in albums_resp.json().get('items', []):
-            if album['name'] not in seen:
-                albums.append(album)
-                seen.add(album['name'])
-            if len(albums) == 2:
-                break
+    seen = set()
+    for album in items:
+        if album['name'] not in seen:
+            albums.append(Album.from_json(album))
+            seen.add(album['name'])
+        if len(albums) == count:
+            break
+    return albums
+
+def enrich_artist(token, artist, concurrent=True, strict=False):
+    """Add top tracks, related artists and albums to an Artist (with strict, failed lookups raise)"""
+    artist_id = artist.id
+    fetchers = {
+        'top_tracks': get_artist_top_tracks,
+        'related_artists': get_related_artists,
+        'albums': get_artist_albums,
+    }
+    print(f"Getting top tracks, related artists and albums for {artist.name}...")
+    
+    if concurrent:
+        # The three lookups are independent, so issue them at the same time
+        with ThreadPoolExecutor(max_workers=len(fetchers)) as executor:
+            futures = {key: executor.submit(fetch, token, artist_id, strict=strict) for key, fetch in fetchers.items()}
+            for key, future in futures.items():
+                try:
+                    setattr(artist, key, future.result())
+                except Exception as e:
+                    if strict:
+                        raise
+                    print(f"Error getting {key.replace('_', ' ')}: {e}")
+                    setattr(artist, key, [])
     else:
-        print(f"Error getting albums: {albums_resp.json()}")
-    artist['albums'] = albums
+        for key, fetch in fetchers.items():
+            setattr(artist, key, fetch(token, artist_id, strict=strict))
     
     # Try to get concert information (this is a simulation as Spotify API doesn't provide this)
-    artist['concerts'] = []
+    artist.concerts = []
     # Just print a message about this limitation in the display function instead
     
     return artist
@@ -350,200 +1408,1692 @@ def display_artist_details(artist, token):
         return
     
     try:
-        print(f"\n===== ARTIST DETAILS: {artist['name']} =====\n")
-        print(f"Popularity: {artist['popularity']}/100")
-        print(f"Followers: {artist['followers']['total']:,}")
+        print(f"\n===== ARTIST DETAILS: {artist.name} =====\n")
+        print(f"Popularity: {artist.popularity}/100")
+        print(f"Followers: {artist.followers:,}")
         
         # Display genres
-        genres = ', '.join(artist['genres']) if artist['genres'] else 'N/A'
+        genres = ', '.join(artist.genres) if artist.genres else 'N/A'
         print(f"Genres: {genres}")
-        print(f"Spotify URL: {artist['external_urls']['spotify']}")
+        print(f"Spotify URL: {artist.spotify_url}")
         
         # Display artist image
-        if artist.get('images') and len(artist['images']) > 0:
-            print(f"Image: {artist['images'][0]['url']}")
+        if artist.image_url:
+            print(f"Image: {artist.image_url}")
         else:
             print("No artist image available.")
             
         # Display top tracks with audio features
-        if artist['top_tracks']:
+        if artist.top_tracks:
             print("\n===== TOP SONGS =====")
-            for idx, track in enumerate(artist['top_tracks'][:5], 1):
-                print(f"{idx}. {track['name']}")
-                print(f"   Spotify URL: {track['external_urls']['spotify']}")
-                if track['album']['images']:
-                    print(f"   Image: {track['album']['images'][0]['url']}")
-                print(f"   Popularity: {track['popularity']}")
-                print(f"   Album: {track['album']['name']}")
-
-                if track['album']['images']:
-                    print(f"   Image: {track['album']['images'][0]['url']}")
-                print(f"   Preview: {track['preview_url'] if track['preview_url'] else 'Not available'}")
+            for idx, track in enumerate(artist.top_tracks[:5], 1):
+                print(f"{idx}. {track.name}")
+                print(f"   Spotify URL: {track.spotify_url}")
+                if track.album_image_url:
+                    print(f"   Image: {track.album_image_url}")
+                print(f"   Popularity: {track.popularity}")
+                print(f"   Album: {track.album_name}")
+
+                if track.album_image_url:
+                    print(f"   Image: {track.album_image_url}")
+                print(f"   Preview: {track.preview_url if track.preview_url else 'Not available'}")
 
             
             # Display albums (top 2)
-        if artist['albums']:
+        if artist.albums:
             print("\n===== TOP ALBUMS =====")
-            for idx, album in enumerate(artist['albums'][:2], 1):
-                print(f"{idx}. {album['name']}")
-                print(f"   Release date: {album['release_date']}")
-                if album['images']:
-                    print(f"   Image: {album['images'][0]['url']}")
-                print(f"   Spotify URL: {album['external_urls']['spotify']}")
+            for idx, album in enumerate(artist.albums[:2], 1):
+                print(f"{idx}. {album.name}")
+                print(f"   Release date: {album.release_date}")
+                if album.image_url:
+                    print(f"   Image: {album.image_url}")
+                print(f"   Spotify URL: {album.spotify_url}")
         else:
             print("\nNo albums available")
         
         # Display related artists
 
-        if artist.get('related_artists') is None:
+        if artist.related_artists is None:
             print("\nSpotify does not provide similar artists for this artist (API limitation).")
-        elif artist.get('related_artists'):
+        elif artist.related_artists:
             print("\n===== SIMILAR ARTISTS =====")
-            for idx, rel in enumerate(artist['related_artists'][:5], 1):
-                rel_name = rel.get('name', 'N/A')
-                rel_pop = rel.get('popularity', 'N/A')
-                rel_url = rel.get('external_urls', {}).get('spotify', 'N/A')
+            for idx, rel in enumerate(artist.related_artists[:5], 1):
+                rel_name = rel.name or 'N/A'
+                rel_pop = rel.popularity if rel.popularity is not None else 'N/A'
+                rel_url = rel.spotify_url or 'N/A'
                 print(f"{idx}. {rel_name} (Popularity: {rel_pop}) - {rel_url}")
         else:
             print("\nNo related artists available")
             
         # Display artist image, concert and about info via Spotify
         print("\n===== ARTIST ON TOUR & ABOUT INFO =====")
-        if artist.get('images') and len(artist['images']) > 0:
-            print(f"Artist Image: {artist['images'][0]['url']}")
+        if artist.image_url:
+            print(f"Artist Image: {artist.image_url}")
         else:
             print("No artist image available.")
         print(f"Visit the artist's official Spotify page for tour dates and biography:")
-        print(f"{artist['external_urls']['spotify']}")
+        print(f"{artist.spotify_url}")
         print("Look for the 'On Tour' and 'About' sections on the Spotify page.")
     except Exception as e:
         print(f"Error displaying artist details: {str(e)}")
 
-def get_user_playlists(token, limit=50):
-    """Get the user's playlists"""
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    
-    print(f"\nGetting your playlists...")
-    response = requests.get(f"{API_BASE_URL}me/playlists?limit={limit}", headers=headers)
-    print(f"Playlists response status code: {response.status_code}")
-    
+def get_page(token, url, params=None, what='items', strict=False):
+    """Get one page of a paged endpoint, or None on error (with strict, the error is raised)"""
+    response = api_client.get(url, token, params=params)
     if response.status_code != 200:
-        print(f"Error getting playlists: {response.json()}")
-        return []
+        print(f"Error getting {what}: {response.json()}")
+        if strict:
+            response.raise_for_status()
+        return None
+    return response.json()
+
+class StreamedPage:
+    """Items of a streamed JSON page, decoded one at a time as the body arrives.
+
+    Iterating yields the elements of the first "items" array in the document
+    without building the whole document. A body that ends early raises
+    requests' InvalidJSONError, like other failed requests. Once iteration finishes, meta holds
+    the rest of the page (next, total, ...) with an empty items list. The
+    response is closed when iteration ends or the iterator is discarded.
+    """
+
+    def __init__(self, response, key='items', chunk_size=STREAM_CHUNK_SIZE):
+        self.response = response
+        self.key = key
+        self.chunk_size = chunk_size
+        self.meta = None
+
+    def _chunks(self):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in self.response.iter_content(chunk_size=self.chunk_size):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    def close(self):
+        self.response.close()
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        chunks = self._chunks()
+        array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(self.key))
+        buf = ''
+        try:
+            # Read up to the opening bracket of the items array
+            while True:
+                match = array_start.search(buf)
+                if match:
+                    prefix = buf[:match.end() - 1]
+                    buf = buf[match.end():]
+                    break
+                chunk = next(chunks, None)
+                if chunk is None:
+                    # No items array at all
+                    self.meta = json.loads(buf)
+                    return
+                buf += chunk
+            
+            # Decode one element at a time, reading more only when one is incomplete
+            pos = 0
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buf) and buf[pos] == ']':
+                    pos += 1
+                    break
+                try:
+                    if pos == len(buf):
+                        raise ValueError
+                    item, end = decoder.raw_decode(buf, pos)
+                    # A number cut at a chunk boundary decodes as a shorter one; wait for its delimiter
+                    if end == len(buf) or buf[end] not in ' \t\r\n,]':
+                        raise ValueError
+                except ValueError:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        import requests
+                        raise requests.exceptions.InvalidJSONError("Truncated JSON response")
+                    buf = buf[pos:] + chunk
+                    pos = 0
+                    continue
+                yield item
+                pos = end
+            
+            # The rest of the page is small: rebuild it with an empty items list
+            self.meta = json.loads(prefix + '[]' + buf[pos:] + ''.join(chunks))
+        finally:
+            self.close()
+
+def get_streamed_page(token, url, params=None, what='items', strict=False):
+    """Start streaming one page of a paged endpoint; returns a StreamedPage or None on error"""
+    response = api_client.get(url, token, params=params, stream=True)
+    if response.status_code != 200:
+        print(f"Error getting {what}: {response.json()}")
+        response.close()
+        if strict:
+            response.raise_for_status()
+        return None
+    return StreamedPage(response)
+
+def iter_paged_items(token, url, params=None, max_items=None, prefetch=True, what='items', stream=None,
+                     strict=False):
+    """Yield the items of a paged endpoint one at a time, following 'next' links lazily.
+
+    With prefetch, the next page is requested in the background while the
+    current one is being consumed. Only one page is held in memory at a time.
+    With stream (default: STREAM_JSON), items are decoded straight from the
+    response body instead; the next link is only known once a page has been
+    read, so streamed pages are not prefetched. Without strict, a page that
+    can't be fetched ends the listing early; with strict, its error is raised.
+    """
+    if stream is None:
+        stream = STREAM_JSON
+    if stream:
+        yield from iter_streamed_items(token, url, params, max_items, what, strict)
+        return
     
-    playlists = response.json().get('items', [])
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = get_page(token, url, params, what, strict)
+        count = 0
+        while page:
+            next_url = page.get('next')
+            next_page = None
+            if next_url and (max_items is None or count + len(page.get('items', [])) < max_items):
+                if executor:
+                    next_page = executor.submit(get_page, token, next_url, None, what, strict)
+            else:
+                next_url = None
+            
+            for item in page.get('items', []):
+                if max_items is not None and count >= max_items:
+                    return
+                # Spotify occasionally returns null entries (e.g. removed items)
+                if item is None:
+                    continue
+                yield item
+                count += 1
+            
+            if next_page is not None:
+                page = next_page.result()
+            elif next_url:
+                page = get_page(token, next_url, None, what, strict)
+            else:
+                page = None
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_streamed_items(token, url, params=None, max_items=None, what='items', strict=False):
+    """Streaming variant of iter_paged_items"""
+    count = 0
+    while url:
+        page = get_streamed_page(token, url, params, what, strict)
+        if page is None:
+            return
+        for item in page:
+            if max_items is not None and count >= max_items:
+                page.close()
+                return
+            if item is None:
+                continue
+            yield item
+            count += 1
+        url, params = page.meta.get('next'), None
+
+def iter_user_playlists(token, max_items=None, offset=0, page_size=50, prefetch=True, stream=None, strict=False):
+    """Yield the user's playlists one at a time.
+
+    To resume an interrupted listing, pass the previous offset plus the number
+    of playlists already consumed as offset.
+    """
+    print(f"\nGetting your playlists...")
+    params = {'limit': page_size, 'offset': offset}
+    items = iter_paged_items(token, "me/playlists", params, max_items, prefetch, what='playlists', stream=stream,
+                             strict=strict)
+    return (Playlist.from_json(item) for item in items)
+
+def get_user_playlists(token, limit=None):
+    """Get the user's playlists (all of them, or at most limit)"""
+    playlists = list(iter_user_playlists(token, max_items=limit))
     print(f"Found {len(playlists)} playlists")
     return playlists
 
 def display_playlists(playlists):
-    """Display a list of playlists"""
-    if not playlists:
-        print("No playlists found")
-        return
-    
-    print("\n===== YOUR PLAYLISTS =====\n")
+    """Display a list (or a stream) of playlists as they arrive"""
+    count = 0
     for i, playlist in enumerate(playlists, 1):
+        if i == 1:
+            print("\n===== YOUR PLAYLISTS =====\n")
+        count = i
         try:
-            name = playlist['name'].encode('ascii', 'replace').decode('ascii')
+            name = playlist.name.encode('ascii', 'replace').decode('ascii')
             print(f"{i}. {name}")
-            print(f"   Tracks: {playlist['tracks']['total']}")
-            print(f"   Public: {playlist['public']}")
-            print(f"   Collaborative: {playlist['collaborative']}")
-            if playlist['images']:
-                print(f"   Image: {playlist['images'][0]['url'] if playlist['images'] else 'No image'}")
+            print(f"   Tracks: {playlist.track_count}")
+            print(f"   Public: {playlist.public}")
+            print(f"   Collaborative: {playlist.collaborative}")
+            if playlist.image_url:
+                print(f"   Image: {playlist.image_url}")
             print()
         except Exception as e:
             print(f"Error displaying playlist {i}: {str(e)}")
+    
+    if count == 0:
+        print("No playlists found")
 
-def search_artist_with_saved_token():
-    """Use the saved token to search for an artist"""
-    access_token = get_valid_token()
-    if not access_token:
+class JobCheckpoint:
+    """Completed units of a resumable job (e.g. playlist pages, input lines), saved atomically.
+
+    A checkpoint belongs to one job and its parameters; a file left by a
+    different job is ignored. When the job writes an output file through
+    open_output, the checkpoint also records the file's size as of the last
+    finished unit, and on resume the file is cut back to it so nothing
+    written for an unfinished unit is duplicated. Use it as a context manager: on success the checkpoint file
+    is removed, on any error or Ctrl+C it is saved for the next run. With
+    path=None nothing is kept.
+    """
+
+    def __init__(self, path, job, params, restart=False):
+        self.path = path
+        self.job = job
+        self.params = params
+        self.done = set()
+        # Units of work finished so far (e.g. tracks written), for progress reporting
+        self.progress = 0
+        self.resumed = False
+        self.output = None
+        self._output_size = 0
+        self._saved_at = time.time()
+        if path and os.path.exists(path) and not restart:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('job') == job and data.get('params') == params:
+                self.done = set(data['done'])
+                self.progress = data.get('progress', 0)
+                self._output_size = data.get('output_size', 0)
+                self.resumed = True
+                print(f"Resuming from {path} ({len(self.done)} units already done)")
+            else:
+                print(f"Ignoring checkpoint {path}: it was written by a different job")
+
+    def __contains__(self, unit):
+        return unit in self.done
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.path:
+            return False
+        if exc_type is None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        else:
+            self.save()
+            reason = 'interrupted' if exc_type is KeyboardInterrupt else f"stopped by {exc_type.__name__}: {exc}"
+            print(f"\nJob {reason}. Progress saved to {self.path}; run the same command again to resume.")
         return False
+
+    def open_output(self, path):
+        """Open the job's output file, continuing after what was checkpointed when resuming"""
+        if self.resumed and os.path.exists(path):
+            f = open(path, 'r+', encoding='utf-8', newline='')
+            f.truncate(self._output_size)
+            f.seek(self._output_size)
+        else:
+            f = open(path, 'w', encoding='utf-8', newline='')
+        self.output = f
+        return f
+
+    def add(self, unit, progress=0):
+        """Mark a unit done (after its output was written) and save if it's been a while"""
+        self.done.add(unit)
+        self.progress += progress
+        if self.path and self.output is not None:
+            # The last point where the output and the done units agree
+            self.output.flush()
+            self._output_size = os.path.getsize(self.output.name)
+        if time.time() - self._saved_at >= JOB_CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        data = {
+            'job': self.job,
+            'params': self.params,
+            'done': sorted(self.done),
+            'progress': self.progress,
+            'output_size': self._output_size,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.time()
+
+class JobProgress:
+    """Progress line with rate and ETA for a long-running job, printed every JOB_PROGRESS_INTERVAL seconds"""
+
+    def __init__(self, what, total=None, done=0):
+        self.what = what
+        self.total = total
+        self.done = done
+        self._started = time.time()
+        self._start_done = done
+        self._printed_at = 0
+        # Rewrite one line on a terminal; print separate lines into logs
+        self._end = '\r' if sys.stdout.isatty() else '\n'
+
+    def advance(self, count=1, total=None):
+        self.done += count
+        if total is not None:
+            self.total = total
+        if time.time() - self._printed_at >= JOB_PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self, end=None):
+        self._printed_at = time.time()
+        elapsed = self._printed_at - self._started
+        rate = (self.done - self._start_done) / elapsed if elapsed else 0
+        line = f"{self.what}: {self.done}"
+        if self.total:
+            line += f"/{self.total} ({100 * self.done / self.total:.0f}%)"
+        line += f", {rate:.1f}/s"
+        if self.total and rate:
+            remaining = max(0, self.total - self.done) / rate
+            line += f", ETA {int(remaining // 3600)}:{int(remaining % 3600 // 60):02d}:{int(remaining % 60):02d}"
+        print(line, end=end or self._end, flush=True)
+
+    def finish(self):
+        self.report(end='\n')
+
+def get_track_page_items(token, url, params, stream):
+    """Items of one playlist tracks page (a list, or a StreamedPage when streaming); errors are raised"""
+    if stream:
+        return get_streamed_page(token, url, params, 'playlist tracks', strict=True)
+    return get_page(token, url, params, what='playlist tracks', strict=True).get('items', [])
+
+def iter_playlist_track_pages(token, playlist_id, executor, stream=None, skip_offsets=()):
+    """Yield (offset, items) for each page of a playlist's tracks, in order.
+
+    The first page reveals the total; the remaining pages are then fetched in
+    parallel on executor, with at most EXPORT_CONCURRENCY pages in flight.
+    When streaming, each page's items are decoded while they are consumed.
+    Pages at skip_offsets are not yielded; if the first page is one of them,
+    only its total is requested. Errors are raised rather than yielding an
+    empty page, so an export never records a page it didn't get.
+    """
+    if stream is None:
+        stream = STREAM_JSON
+    url = f"playlists/{playlist_id}/tracks"
+    params = {'limit': EXPORT_PAGE_SIZE, 'offset': 0, 'fields': EXPORT_TRACK_FIELDS}
+    if 0 in skip_offsets:
+        first_page = get_page(token, url, dict(params, limit=1, fields='total'), what='playlist tracks', strict=True)
+        total = first_page.get('total', 0)
+    elif stream:
+        first_page = get_streamed_page(token, url, params, 'playlist tracks', strict=True)
+        try:
+            yield 0, first_page
+            # A streamed page knows its total once it has been read; finish it if the caller didn't
+            if first_page.meta is None:
+                for _ in first_page:
+                    pass
+        finally:
+            first_page.close()
+        total = first_page.meta.get('total', 0)
+    else:
+        first_page = get_page(token, url, params, what='playlist tracks', strict=True)
+        yield 0, first_page.get('items', [])
+        total = first_page.get('total', 0)
+    
+    pending = deque()
+    for offset in range(EXPORT_PAGE_SIZE, total, EXPORT_PAGE_SIZE):
+        if offset in skip_offsets:
+            continue
+        page_params = dict(params, offset=offset)
+        pending.append((offset, executor.submit(get_track_page_items, token, url, page_params, stream)))
+        if len(pending) >= EXPORT_CONCURRENCY:
+            offset, future = pending.popleft()
+            yield offset, future.result()
+    while pending:
+        offset, future = pending.popleft()
+        yield offset, future.result()
+
+def playlist_track_row(playlist, position, item):
+    """Flatten one playlist track item into an export row"""
+    track = item.get('track') or {}
+    return {
+        'playlist_id': playlist.id,
+        'playlist_name': playlist.name,
+        'position': position,
+        'track_id': track.get('id'),
+        'track_name': track.get('name'),
+        'artists': ', '.join(a.get('name') or '' for a in track.get('artists') or []),
+        'album': (track.get('album') or {}).get('name'),
+        'duration_ms': track.get('duration_ms'),
+        'added_at': item.get('added_at'),
+    }
+
+def export_playlists(token, path, resume=True):
+    """Export every track of every playlist to path (.csv, otherwise NDJSON).
+
+    Finished pages are checkpointed to path.checkpoint, so an interrupted
+    export continues where it stopped (unless resume=False). A request that
+    still fails after its retries stops the export, and the next run retries it.
+    """
+    as_csv = path.lower().endswith('.csv')
+    started = time.time()
+    track_count = 0
+    
+    playlists = list(iter_user_playlists(token, strict=True))
+    checkpoint = JobCheckpoint(f"{path}.checkpoint", 'export-playlists', {'path': path}, restart=not resume)
+    progress = JobProgress("Tracks exported", sum(p.track_count or 0 for p in playlists), checkpoint.progress)
+    with checkpoint, checkpoint.open_output(path) as f, \
+            ThreadPoolExecutor(max_workers=EXPORT_CONCURRENCY) as executor:
+        if as_csv:
+            writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+            if f.tell() == 0:
+                writer.writeheader()
+            write_row = writer.writerow
+        else:
+            write_row = lambda row: f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        for playlist in playlists:
+            if playlist.id in checkpoint:
+                continue
+            # Units are finished pages ("id:offset"), folded into the playlist ID once it's complete
+            done_offsets = {int(unit.rsplit(':', 1)[1]) for unit in checkpoint.done
+                            if unit.startswith(f"{playlist.id}:")}
+            pages = iter_playlist_track_pages(token, playlist.id, executor, skip_offsets=done_offsets)
+            for offset, items in pages:
+                page_tracks = 0
+                for index, item in enumerate(items):
+                    if item:
+                        write_row(playlist_track_row(playlist, offset + index, item))
+                        page_tracks += 1
+                track_count += page_tracks
+                checkpoint.add(f"{playlist.id}:{offset}", page_tracks)
+                progress.advance(page_tracks)
+            checkpoint.done -= {unit for unit in checkpoint.done if unit.startswith(f"{playlist.id}:")}
+            checkpoint.add(playlist.id)
+        progress.finish()
+    
+    elapsed = time.time() - started
+    print(f"\nExported {track_count} tracks from {len(playlists)} playlists to {path} "
+          f"in {elapsed:.1f}s ({track_count / elapsed if elapsed else 0:.0f} tracks/s)")
+    return track_count
+
+class ArtistStore:
+    """SQLite store of minimal artist records keyed by Spotify artist ID"""
+
+    def __init__(self, path=None, legacy_json=SAVED_ARTISTS_JSON):
+        self.path = path or ARTIST_STORE_FILE
+        self._lock = threading.Lock()
+        # timeout: wait for other processes holding the write lock instead of failing
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS artists ("
+            " id TEXT PRIMARY KEY, name TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS artists_name ON artists (name)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # When each artist was last viewed and last refreshed, for the refresh schedule
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS activity (id TEXT PRIMARY KEY, viewed_at REAL, refreshed_at REAL)"
+        )
+        # Popularity and followers over time; a point is only added when either changes
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats_history ("
+            " id TEXT NOT NULL, ts INTEGER NOT NULL, popularity INTEGER, followers INTEGER,"
+            " PRIMARY KEY (id, ts)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._migrate_json(legacy_json)
+
+    def _migrate_json(self, json_file):
+        # One-shot import of the old name-keyed saved_artists.json
+        if not json_file or not os.path.exists(json_file):
+            return
+        with self._lock, self._conn:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_json'").fetchone()
+            if done:
+                return
+            with open(json_file, "r", encoding="utf-8") as f:
+                all_artists = json.load(f)
+            records = [a for a in all_artists.values() if a.get('id')]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO artists (id, name, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(a['id'], a.get('name') or '', json.dumps(a, ensure_ascii=False), time.time()) for a in records],
+            )
+            self._conn.execute("INSERT INTO meta VALUES ('migrated_json', ?)", (json_file,))
+        print(f"Migrated {len(records)} artists from {json_file} to {self.path}")
+
+    def upsert(self, minimal_artist):
+        """Insert or replace an artist record; returns True if it was new"""
+        with self._lock, self._conn:
+            existed = self._conn.execute(
+                "SELECT 1 FROM artists WHERE id = ?", (minimal_artist['id'],)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artists (id, name, data, updated_at) VALUES (?, ?, ?, ?)",
+                (minimal_artist['id'], minimal_artist.get('name') or '',
+                 json.dumps(minimal_artist, ensure_ascii=False), time.time()),
+            )
+        if _artist_index is not None:
+            _artist_index.add(minimal_artist)
+        return existed is None
+
+    def get(self, artist_id):
+        """Return the saved record for an artist ID, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM artists WHERE id = ?", (artist_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def changed_since(self, since):
+        """(record, updated_at) pairs for artists saved after the since timestamp, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data, updated_at FROM artists WHERE updated_at > ? ORDER BY updated_at", (since,)
+            ).fetchall()
+        return [(json.loads(data), updated_at) for data, updated_at in rows]
+
+    def mark_viewed(self, artist_id, when=None):
+        """Remember that an artist was just looked at, so it gets refreshed more often"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO activity (id, viewed_at) VALUES (?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET viewed_at = excluded.viewed_at",
+                (artist_id, when or time.time()),
+            )
+
+    def refresh_candidates(self):
+        """(id, popularity, viewed_at, refreshed_at) for every saved artist.
+
+        Artists never refreshed count as refreshed when they were saved.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT a.id, json_extract(a.data, '$.popularity'), v.viewed_at,"
+                " COALESCE(v.refreshed_at, a.updated_at)"
+                " FROM artists a LEFT JOIN activity v ON v.id = a.id"
+            ).fetchall()
+
+    def apply_refresh(self, artist, when=None):
+        """Update a saved artist from a freshly fetched Artist; returns True if anything changed.
+
+        Only the fields the artist endpoint returns are replaced; top tracks,
+        albums and related artists are kept. Popularity and followers are
+        appended to the artist's stats history when they changed.
+        """
+        when = when or time.time()
+        record = self.get(artist.id)
+        if record is None:
+            return False
+        fresh = {
+            'name': artist.name,
+            'spotify_url': artist.spotify_url,
+            'popularity': artist.popularity,
+            'followers': artist.followers,
+            'genres': artist.genres,
+            'image_url': artist.image_url,
+        }
+        changed = any(record.get(key) != value for key, value in fresh.items())
+        if changed:
+            record.update(fresh)
+            self.upsert(record)
+        with self._lock, self._conn:
+            last = self._conn.execute(
+                "SELECT popularity, followers FROM stats_history WHERE id = ? ORDER BY ts DESC LIMIT 1",
+                (artist.id,),
+            ).fetchone()
+            if last != (artist.popularity, artist.followers):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO stats_history VALUES (?, ?, ?, ?)",
+                    (artist.id, int(when), artist.popularity, artist.followers),
+                )
+            self._conn.execute(
+                "INSERT INTO activity (id, refreshed_at) VALUES (?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET refreshed_at = excluded.refreshed_at",
+                (artist.id, when),
+            )
+        return changed
+
+    def stats_history(self, artist_id):
+        """(timestamp, popularity, followers) points recorded for an artist, oldest first"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ts, popularity, followers FROM stats_history WHERE id = ? ORDER BY ts", (artist_id,)
+            ).fetchall()
+
+    def names(self):
+        """Names of all saved artists, in alphabetical order"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM artists ORDER BY name")]
+
+    def __iter__(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM artists ORDER BY name").fetchall()
+        return (json.loads(row[0]) for row in rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM artists").fetchone()[0]
+
+_artist_store = None
+
+def get_artist_store():
+    """Open the artist store on first use and share it afterwards"""
+    global _artist_store
+    if _artist_store is None:
+        _artist_store = ArtistStore()
+    return _artist_store
+
+def normalize_text(text):
+    """Lowercase text and strip accents so 'Beyoncé' matches 'beyonce'"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+def text_trigrams(text):
+    """Trigrams of each word of text, padded so word starts and ends count"""
+    grams = set()
+    for word in re.findall(r'\w+', normalize_text(text)):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class ArtistIndex:
+    """In-memory trigram index over saved artists' names, genres, track names and album names.
+
+    Matching on trigrams makes queries tolerant to typos and partial words.
+    Each trigram maps to the artists containing it, weighted by the most
+    important field it appears in (INDEX_FIELD_WEIGHTS).
+    """
+
+    def __init__(self, records=()):
+        self.records = {}
+        self.postings = {}
+        # artist ID -> normalized name and the trigrams it was indexed under
+        self.names = {}
+        self.grams = {}
+        # Trigram -> its top INDEX_MAX_POSTINGS artists, for trigrams more common than that
+        self._top = {}
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        """Index (or re-index) one saved artist record"""
+        artist_id = record['id']
+        if artist_id in self.records:
+            self.remove(artist_id)
+        self.records[artist_id] = record
+        self.names[artist_id] = normalize_text(record.get('name')).strip()
+        fields = {
+            'name': [record.get('name')],
+            'genres': record.get('genres') or [],
+            'tracks': [t.get('name') for t in record.get('top_tracks') or []],
+            'albums': [a.get('name') for a in record.get('albums') or []],
+        }
+        weights = {}
+        for field_name, texts in fields.items():
+            for text in texts:
+                for gram in text_trigrams(text):
+                    weights[gram] = max(weights.get(gram, 0), INDEX_FIELD_WEIGHTS[field_name])
+        for gram, weight in weights.items():
+            self.postings.setdefault(gram, {})[artist_id] = weight
+            self._top.pop(gram, None)
+        self.grams[artist_id] = list(weights)
+
+    def remove(self, artist_id):
+        self.records.pop(artist_id, None)
+        self.names.pop(artist_id, None)
+        for gram in self.grams.pop(artist_id, ()):
+            docs = self.postings[gram]
+            docs.pop(artist_id, None)
+            if not docs:
+                del self.postings[gram]
+            self._top.pop(gram, None)
+
+    def _candidates(self, gram):
+        """Artists to consider for a trigram: all of them, or the top ones if it is very common"""
+        docs = self.postings.get(gram, {})
+        if len(docs) <= INDEX_MAX_POSTINGS:
+            return docs
+        top = self._top.get(gram)
+        if top is None:
+            top = self._top[gram] = heapq.nlargest(
+                INDEX_MAX_POSTINGS, docs,
+                key=lambda artist_id: (docs[artist_id], self.records[artist_id].get('popularity') or 0))
+        return top
+
+    def search(self, query, limit=5, min_score=INDEX_MIN_SCORE):
+        """Return up to limit (score, record) pairs, best first.
+
+        An artist matches when at least min_score of the query's trigrams are
+        found in any of its fields. Matches are ranked by field weight, so a
+        hit on the name outranks the same hit on an album title.
+        """
+        grams = text_trigrams(query)
+        if not grams:
+            return []
+        best = max(INDEX_FIELD_WEIGHTS.values())
+        # An artist with the hits it needs appears under at least one of the
+        # len(grams) - needed + 1 rarest trigrams, so only those produce candidates
+        needed = math.ceil(min_score * len(grams) - 1e-9)
+        ordered = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))
+        postings = [self.postings.get(gram, {}) for gram in ordered]
+        candidates = set()
+        for gram in ordered[:len(ordered) - needed + 1]:
+            candidates.update(self._candidates(gram))
+        wanted = normalize_text(query).strip()
+        results = []
+        for artist_id in candidates:
+            hits = 0
+            total = 0
+            for docs in postings:
+                weight = docs.get(artist_id)
+                if weight:
+                    hits += 1
+                    total += weight
+            if hits / len(grams) < min_score:
+                continue
+            score = total / (len(grams) * best)
+            if self.names[artist_id] == wanted:
+                score += 1.0  # Exact name matches always come first
+            results.append((score, self.records[artist_id]))
+        return heapq.nlargest(limit, results, key=lambda pair: (pair[0], pair[1].get('popularity') or 0))
+
+_artist_index = None
+
+def get_artist_index():
+    """Build the local search index from the artist store on first use"""
+    global _artist_index
+    if _artist_index is None:
+        _artist_index = ArtistIndex(get_artist_store())
+    return _artist_index
+
+def search_saved_artists(query):
+    """Offer saved artists matching the query; returns the chosen Artist or None to search Spotify"""
+    matches = get_artist_index().search(query)
+    if not matches:
+        return None
+    
+    print(f"\nSaved artists matching '{query}':")
+    for idx, (_, record) in enumerate(matches, 1):
+        genres = ', '.join(record.get('genres') or []) or 'N/A'
+        print(f"{idx}. {record.get('name')} | Genres: {genres} | Popularity: {record.get('popularity')}")
     
+    while True:
+        choice = input(f"\nSelect a saved artist (1-{len(matches)}) or press Enter to search Spotify: ").strip()
+        if not choice:
+            return None
+        if choice.isdigit() and 1 <= int(choice) <= len(matches):
+            return Artist.from_record(matches[int(choice) - 1][1])
+        print("Invalid selection. Try again.")
+
+def spotify_id_from_url(url):
+    """The ID at the end of an open.spotify.com link (records saved before IDs were kept)"""
+    return url.rstrip('/').rsplit('/', 1)[-1].split('?', 1)[0] if url else None
+
+def columnar_rows(record, updated_at):
+    """Split one saved artist record into rows of the COLUMNAR_TABLES tables"""
+    artist_id = record['id']
+    return {
+        'artists': [(
+            artist_id, record.get('name'), record.get('popularity'), record.get('followers'),
+            ';'.join(record.get('genres') or []), record.get('image_url'), record.get('spotify_url'),
+            updated_at,
+        )],
+        'top_tracks': [(
+            artist_id, rank, track.get('id') or spotify_id_from_url(track.get('spotify_url')),
+            track.get('name'), track.get('album'), track.get('popularity'), track.get('spotify_url'),
+            track.get('preview_url'), updated_at,
+        ) for rank, track in enumerate(record.get('top_tracks') or [], 1)],
+        'albums': [(
+            artist_id, rank, album.get('id') or spotify_id_from_url(album.get('spotify_url')),
+            album.get('name'), album.get('release_date'), album.get('image_url'), album.get('spotify_url'),
+            updated_at,
+        ) for rank, album in enumerate(record.get('albums') or [], 1)],
+    }
+
+def write_columnar_table(directory, name, rows, fmt, part):
+    """Append rows to one table: a new part file for Parquet/Arrow, appended lines for CSV"""
+    columns = COLUMNAR_TABLES[name]
+    if fmt == 'csv':
+        path = os.path.join(directory, f"{name}.csv")
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow([column for column, _ in columns])
+            writer.writerows(rows)
+        return path
+    
+    import pyarrow as pa
+    schema = pa.schema([(column, getattr(pa, type_name)()) for column, type_name in columns])
+    table = pa.Table.from_arrays(
+        [pa.array(values, type=schema.field(i).type) for i, values in enumerate(zip(*rows))]
+        if rows else [pa.array([], type=field.type) for field in schema],
+        schema=schema,
+    )
+    table_dir = os.path.join(directory, name)
+    os.makedirs(table_dir, exist_ok=True)
+    path = os.path.join(table_dir, f"part-{part:05d}.{fmt}")
+    tmp_path = f"{path}.tmp"
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, tmp_path)
+    else:
+        # Arrow IPC files can be memory-mapped and read without copying
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return path
+
+def export_saved_artists(directory=COLUMNAR_EXPORT_DIR, fmt=None, full=False):
+    """Export saved artists, their top tracks and albums as flat columnar tables.
+
+    Only artists saved or changed since the previous export into the same
+    directory are written, as new rows; an artist that changed appears again
+    with a newer updated_at, so readers keep the latest row per ID. With
+    full=True the directory is rewritten from scratch.
+    """
+    state_path = os.path.join(directory, 'export_state.json')
+    state = {}
+    if not full and os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    
+    if fmt and state.get('format') and fmt != state['format']:
+        print(f"{directory} holds a {state['format']} export; use --full to rewrite it as {fmt}")
+        return None
+    fmt = fmt or state.get('format')
+    if fmt is None:
+        try:
+            import pyarrow  # noqa: F401  (optional, needed for parquet and arrow)
+            fmt = 'parquet'
+        except ImportError:
+            fmt = 'csv'
+    
+    changed = get_artist_store().changed_since(state.get('exported_until', 0))
+    if not changed:
+        print(f"No artists saved or changed since the last export to {directory}")
+        return 0
+    
+    os.makedirs(directory, exist_ok=True)
+    if full:
+        for name in COLUMNAR_TABLES:
+            csv_path = os.path.join(directory, f"{name}.csv")
+            if os.path.exists(csv_path):
+                os.remove(csv_path)
+            table_dir = os.path.join(directory, name)
+            if os.path.isdir(table_dir):
+                for part_file in os.listdir(table_dir):
+                    os.remove(os.path.join(table_dir, part_file))
+    
+    tables = {name: [] for name in COLUMNAR_TABLES}
+    for record, updated_at in changed:
+        for name, rows in columnar_rows(record, updated_at).items():
+            tables[name].extend(rows)
+    
+    part = state.get('parts', 0) + 1
+    for name, rows in tables.items():
+        path = write_columnar_table(directory, name, rows, fmt, part)
+        print(f"{name}: {len(rows)} rows -> {path}")
+    
+    # Written last, so an interrupted export is simply repeated next time
+    state = {'format': fmt, 'parts': part, 'exported_until': changed[-1][1], 'exported_at': time.time()}
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+    print(f"Exported {len(changed)} artists to {directory} ({fmt})")
+    return len(changed)
+
+def search_artist_with_saved_token(remote=False):
+    """Search saved artists first, then Spotify (always Spotify with remote=True)"""
     # Get the search query from the user
     query = input("Enter an artist name or song title to search: ")
     if not query:
         print("No search query provided")
         return False
     
+    if not remote:
+        artist = search_saved_artists(query)
+        if artist:
+            display_artist_details(artist, None)
+            get_artist_store().mark_viewed(artist.id)
+            return True
+    
+    access_token = get_valid_token()
+    if not access_token:
+        return False
+    
     # Search for the artist
     artist = search_artist(access_token, query)
     
     # Display the artist details
     display_artist_details(artist, access_token)
 
-    # Save only displayed artist info in saved_artists.json, with artist name as top-level key
-    import os, json
-    json_file = "saved_artists.json"
-    # Load existing data if present
-    if os.path.exists(json_file):
-        with open(json_file, "r", encoding="utf-8") as f:
-            all_artists = json.load(f)
-    else:
-        all_artists = {}
-
-    # Build the minimal info dict for this artist
-    artist_name = artist.get('name', 'Unknown Artist')
-    minimal_artist = {
-        "id": artist.get('id'),
-        "name": artist_name,
-        "spotify_url": artist.get('external_urls', {}).get('spotify'),
-        "popularity": artist.get('popularity'),
-        "followers": artist.get('followers', {}).get('total'),
-        "genres": artist.get('genres'),
-        "image_url": artist.get('images', [{}])[0].get('url') if artist.get('images') else None,
-        "top_tracks": [],
-        "albums": [],
-        "related_artists": [ra.get('name') for ra in (artist.get('related_artists') or [])],
-        "concerts": artist.get('concerts', [])
-    }
-    for track in artist.get('top_tracks', []):
-        minimal_artist['top_tracks'].append({
-            "name": track.get('name'),
-            "album": track.get('album', {}).get('name'),
-            "popularity": track.get('popularity'),
-            "spotify_url": track.get('external_urls', {}).get('spotify'),
-            "preview_url": track.get('preview_url'),
-            "album_image_url": track.get('album', {}).get('images', [{}])[0].get('url') if track.get('album', {}).get('images') else None
-        })
-    for album in artist.get('albums', []):
-        minimal_artist['albums'].append({
-            "name": album.get('name'),
-            "release_date": album.get('release_date'),
-            "image_url": album.get('images', [{}])[0].get('url') if album.get('images') else None,
-            "spotify_url": album.get('external_urls', {}).get('spotify')
-        })
-    # Save using artist name as key
-    if artist_name not in all_artists:
-        all_artists[artist_name] = minimal_artist
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(all_artists, f, indent=2, ensure_ascii=False)
-        print(f"\nSaved artist '{artist_name}' to {json_file} (minimal info only).")
+    if not artist:
+        return False
+
+    # Save only the displayed artist info, keyed by Spotify artist ID
+    minimal_artist = artist.to_record()
+    artist_name = minimal_artist['name']
+    store = get_artist_store()
+    if store.upsert(minimal_artist):
+        print(f"\nSaved artist '{artist_name}' to {store.path} (minimal info only).")
     else:
-        print(f"\nArtist '{artist_name}' already exists in {json_file}, not saving duplicate.")
+        print(f"\nUpdated saved artist '{artist_name}' in {store.path}.")
+    store.mark_viewed(artist.id)
 
     # Print summary of all saved artists
     print("\nArtists currently saved:")
-    for aname in all_artists:
+    for aname in store.names():
         print(f"- {aname}")
     return True
 
+def parse_artist_id(query):
+    """Return the artist ID if the query is an ID, URI or artist link, else None"""
+    match = ARTIST_ID_PATTERN.match(query.strip())
+    return match.group(1) if match else None
+
+def pick_artist_match(query, candidates, policy='exact-or-popular'):
+    """Pick one artist from search results without asking the user.
+
+    exact-or-popular: the most popular exact (case-insensitive) name match,
+                      otherwise the most popular result
+    popular:          the most popular result
+    first:            Spotify's top-ranked result
+    """
+    if not candidates:
+        return None
+    if policy == 'first':
+        return candidates[0]
+    if policy == 'exact-or-popular':
+        wanted = query.strip().casefold()
+        exact = [a for a in candidates if (a.name or '').casefold() == wanted]
+        candidates = exact or candidates
+    return max(candidates, key=lambda a: a.popularity or 0)
+
+def bulk_lookup_artist(token, query, artist=None, policy='exact-or-popular'):
+    """Resolve and enrich one bulk query, returning its minimal record or None if there's no match.
+
+    Request errors are raised, so a failed lookup is never mistaken for a missing artist.
+    """
+    if artist is None:
+        artist = pick_artist_match(query, search_artist_candidates(token, query, strict=True), policy)
+    if artist is None:
+        print(f"No artist found for '{query}'")
+        return None
+    # The bulk workers already run in parallel, so fetch the details in-line
+    enrich_artist(token, artist, concurrent=False, strict=True)
+    return artist.to_record()
+
+def bulk_search(token, lines, out, policy='exact-or-popular', workers=None, save=False, checkpoint=None):
+    """Look up artist names or IDs (one per line) and write their minimal records as NDJSON to out.
+
+    With a JobCheckpoint, finished input lines are recorded in it and lines it
+    already holds are skipped. Only lines that were written or definitely not
+    found count as finished: a request that still fails after its retries
+    stops the run, and the next run retries it.
+    """
+    workers = workers or BULK_WORKERS
+    checkpoint = checkpoint or JobCheckpoint(None, 'bulk-search', {})
+    started = time.time()
+    found = 0
+    missing = 0
+    progress = JobProgress("Artists looked up", len(lines) if hasattr(lines, '__len__') else None,
+                           len(checkpoint.done))
+    
+    def write(futures):
+        nonlocal found, missing
+        for future in futures:
+            record = future.result()
+            if record is None:
+                missing += 1
+            else:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if save:
+                    get_artist_store().upsert(record)
+                found += 1
+            checkpoint.add(futures[future])
+            progress.advance()
+    
+    def batches():
+        # Read the input in chunks so the IDs in each chunk are hydrated with one request;
+        # queries are numbered by input line, which is what the checkpoint remembers
+        batch = []
+        for line_number, line in enumerate(lines):
+            query = line.strip()
+            if not query or line_number in checkpoint:
+                continue
+            batch.append((line_number, query))
+            if len(batch) == ARTISTS_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for batch in batches():
+            ids = [parse_artist_id(query) for _, query in batch]
+            hydrated = {a.id: a for a in get_several_artists(token, [i for i in ids if i], strict=True)}
+            for (line_number, query), artist_id in zip(batch, ids):
+                if artist_id and artist_id not in hydrated:
+                    print(f"No artist found for ID '{artist_id}'")
+                    missing += 1
+                    checkpoint.add(line_number)
+                    progress.advance()
+                    continue
+                future = executor.submit(bulk_lookup_artist, token, query, hydrated.get(artist_id), policy)
+                pending[future] = line_number
+                # Keep a bounded number of lookups in flight
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    write({future: pending.pop(future) for future in done})
+        write(pending)
+    progress.finish()
+    
+    print(f"\nBulk search finished: {found} artists written, {missing} not found, "
+          f"{time.time() - started:.1f}s")
+    return found
+
+def bulk_search_with_saved_token(path, output='-', policy='exact-or-popular', rate_limit=None, save=False,
+                                 resume=True):
+    """Use the saved token to look up every artist listed in path ('-' for stdin).
+
+    With an output file the run is checkpointed to output.checkpoint, so an
+    interrupted lookup continues where it stopped (unless resume=False).
+    """
+    access_token = get_valid_token()
+    if not access_token:
+        return False
+    
+    import requests
+    if rate_limit:
+        # Override the default request budget for this run
+        api_client.rate_limiter = RateLimiter(rate_limit, state_file=RATE_LIMIT_FILE)
+    source = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        if output == '-':
+            # Records go to stdout, so send progress messages to stderr
+            out = sys.stdout
+            with redirect_stdout(sys.stderr):
+                bulk_search(access_token, source, out, policy, save=save)
+        else:
+            # A file input is read up front so progress can show an ETA
+            lines = source if source is sys.stdin else source.readlines()
+            params = {'input': path, 'output': output, 'policy': policy}
+            with JobCheckpoint(f"{output}.checkpoint", 'bulk-search', params, restart=not resume) as checkpoint, \
+                    checkpoint.open_output(output) as out:
+                bulk_search(access_token, lines, out, policy, save=save, checkpoint=checkpoint)
+    except KeyboardInterrupt:
+        return False
+    except requests.RequestException as e:
+        # With an output file, the checkpoint has already reported it
+        if output == '-':
+            print(f"Bulk search stopped: {e}", file=sys.stderr)
+        return False
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return True
+
+class ArtistGraph:
+    """Related-artists graph with integer node IDs and array-backed adjacency lists"""
+
+    def __init__(self):
+        self.ids = []            # node -> Spotify artist ID
+        self.names = []          # node -> artist name
+        self.depth = array('H')  # node -> BFS depth from the nearest seed
+        self.index = {}          # Spotify artist ID -> node
+        # node -> array of neighbour nodes; missing until the node is expanded
+        self.edges = {}
+        # Nodes whose related artists Spotify doesn't provide (404)
+        self.unavailable = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add_node(self, artist_id, name='', depth=0):
+        """Add an artist if it is new (or lower its depth) and return its node number"""
+        node = self.index.get(artist_id)
+        if node is None:
+            node = len(self.ids)
+            self.index[artist_id] = node
+            self.ids.append(artist_id)
+            self.names.append(name)
+            self.depth.append(depth)
+        elif depth < self.depth[node]:
+            self.depth[node] = depth
+        if name and not self.names[node]:
+            self.names[node] = name
+        return node
+
+    def is_expanded(self, node):
+        return node in self.edges or node in self.unavailable
+
+    def frontier(self, max_depth):
+        """Nodes still to expand, shallowest first"""
+        nodes = [n for n in range(len(self.ids)) if self.depth[n] < max_depth and not self.is_expanded(n)]
+        return sorted(nodes, key=lambda n: self.depth[n])
+
+    def neighbors(self, artist_id):
+        """Spotify IDs of an artist's related artists, or None if it hasn't been expanded"""
+        node = self.index.get(artist_id)
+        if node is None or node not in self.edges:
+            return None
+        return [self.ids[n] for n in self.edges[node]]
+
+    def save(self, path):
+        """Write the graph atomically; edges are stored as one flat array plus offsets"""
+        expanded = sorted(self.edges)
+        offsets = array('I', [0])
+        flat = array('I')
+        for node in expanded:
+            flat.extend(self.edges[node])
+            offsets.append(len(flat))
+        data = {
+            'ids': self.ids,
+            'names': self.names,
+            'depth': self.depth.tolist(),
+            'expanded': expanded,
+            'offsets': offsets.tolist(),
+            'edges': flat.tolist(),
+            'unavailable': sorted(self.unavailable),
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        graph = cls()
+        graph.ids = data['ids']
+        graph.names = data['names']
+        graph.depth = array('H', data['depth'])
+        graph.index = {artist_id: node for node, artist_id in enumerate(graph.ids)}
+        flat = array('I', data['edges'])
+        offsets = data['offsets']
+        for i, node in enumerate(data['expanded']):
+            graph.edges[node] = flat[offsets[i]:offsets[i + 1]]
+        graph.unavailable = set(data['unavailable'])
+        return graph
+
+def crawl_related_artists(token, seeds, max_depth=CRAWL_MAX_DEPTH, max_nodes=CRAWL_MAX_NODES,
+                          workers=None, graph=None, path=None):
+    """Breadth-first crawl of the related-artists graph from the seed artist IDs.
+
+    Each BFS level is expanded on a thread pool. The crawl stops at max_depth
+    or once max_nodes artists are known; with path, the graph is checkpointed
+    after every batch so an interrupted crawl can be resumed from the file.
+    Artists whose related artists couldn't be fetched, or didn't all fit
+    within max_nodes, are left unexpanded, so the next run over the same
+    graph (e.g. with a larger max_nodes) expands them in full.
+    """
+    graph = graph if graph is not None else ArtistGraph()
+    for seed in get_several_artists(token, seeds):
+        graph.add_node(seed.id, seed.name, 0)
+    progress = JobProgress("Artists found", max_nodes, len(graph))
+    failed = set()
+    
+    def fetch_related(node):
+        # Return errors instead of raising them, so one failed artist doesn't stop the batch
+        try:
+            return get_related_artists(token, graph.ids[node], strict=True)
+        except Exception as e:
+            return e
+    
+    with ThreadPoolExecutor(max_workers=workers or BULK_WORKERS) as executor:
+        frontier = graph.frontier(max_depth)
+        while frontier and len(graph) < max_nodes:
+            for start in range(0, len(frontier), ARTISTS_BATCH_SIZE):
+                if len(graph) >= max_nodes:
+                    break
+                batch = frontier[start:start + ARTISTS_BATCH_SIZE]
+                for node, related in zip(batch, executor.map(fetch_related, batch)):
+                    if isinstance(related, Exception):
+                        print(f"Error getting related artists for {graph.ids[node]}: {related}")
+                        failed.add(node)
+                        continue
+                    if related is None:
+                        graph.unavailable.add(node)
+                        continue
+                    neighbours = array('I')
+                    truncated = False
+                    for rel in related:
+                        if rel.id not in graph.index and len(graph) >= max_nodes:
+                            truncated = True
+                            continue
+                        neighbours.append(graph.add_node(rel.id, rel.name or '', graph.depth[node] + 1))
+                    # A node missing some neighbours stays unexpanded, so a larger budget re-expands it
+                    if not truncated:
+                        graph.edges[node] = neighbours
+                if path:
+                    graph.save(path)
+                progress.advance(len(graph) - progress.done)
+            frontier = [node for node in graph.frontier(max_depth) if node not in failed]
+    progress.finish()
+    
+    if failed:
+        print(f"Could not get related artists for {len(failed)} artists; run the crawl again to retry them.")
+    if path:
+        graph.save(path)
+    return graph
+
+def crawl_with_saved_token(seeds, path=GRAPH_FILE, max_depth=CRAWL_MAX_DEPTH, max_nodes=CRAWL_MAX_NODES):
+    """Use the saved token to crawl related artists, resuming from path if it exists"""
+    access_token = get_valid_token()
+    if not access_token:
+        return False
+    
+    graph = ArtistGraph.load(path) if os.path.exists(path) else None
+    if graph is not None:
+        print(f"Resuming crawl from {path} ({len(graph)} artists known)")
+    seed_ids = [parse_artist_id(seed) or seed for seed in seeds]
+    try:
+        graph = crawl_related_artists(access_token, seed_ids, max_depth, max_nodes, graph=graph, path=path)
+    except KeyboardInterrupt:
+        print(f"\nCrawl interrupted. Progress is saved in {path}; run the same command again to resume.")
+        return False
+    edge_count = sum(len(e) for e in graph.edges.values())
+    print(f"\nGraph saved to {path}: {len(graph)} artists, {edge_count} edges, "
+          f"{len(graph.unavailable)} without related artists")
+    return True
+
+def load_releases_checkpoint(path):
+    """Load the ingestion checkpoint: album IDs seen per market and artist IDs already hydrated"""
+    if not os.path.exists(path):
+        return {'markets': {}, 'artists': []}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_releases_checkpoint(path, checkpoint):
+    """Write the checkpoint atomically, keeping only the most recent IDs"""
+    for market, album_ids in checkpoint['markets'].items():
+        checkpoint['markets'][market] = album_ids[-CHECKPOINT_MAX_ALBUMS:]
+    checkpoint['artists'] = checkpoint['artists'][-CHECKPOINT_MAX_ARTISTS:]
+    checkpoint['updated_at'] = int(time.time())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def iter_new_releases(token, country, page_size=RELEASES_PAGE_SIZE):
+    """Yield pages (lists of albums) of new releases for one market, newest first"""
+    url = "browse/new-releases"
+    params = {'limit': page_size, 'country': country}
+    while url:
+        page = get_page(token, url, params, what=f"new releases for {country}")
+        if not page:
+            return
+        albums = page.get('albums', {})
+        yield [album for album in albums.get('items', []) if album]
+        url, params = albums.get('next'), None
+
+def ingest_new_releases(token, markets=('US',), path=RELEASES_CHECKPOINT_FILE):
+    """Fetch only the new releases (and their artists) not seen by previous runs.
+
+    New releases are listed newest first, so paging for a market stops at the
+    first page without any unseen album. Returns (new_albums, new_artists).
+    The checkpoint is only saved once the new albums' artists have been
+    fetched; if that fails the error is raised and the next run sees the same
+    albums as new again.
+    """
+    checkpoint = load_releases_checkpoint(path)
+    hydrated = set(checkpoint['artists'])
+    new_albums = []
+    
+    for market in markets:
+        seen_list = checkpoint['markets'].setdefault(market, [])
+        seen = set(seen_list)
+        market_new = 0
+        for albums in iter_new_releases(token, market):
+            fresh = [album for album in albums if album['id'] not in seen]
+            for album in fresh:
+                seen.add(album['id'])
+                seen_list.append(album['id'])
+            new_albums.extend(fresh)
+            market_new += len(fresh)
+            if not fresh:
+                break
+        print(f"{market}: {market_new} new albums")
+    
+    # Only hydrate artists that no earlier run has fetched
+    artist_ids = collect_artist_ids(new_albums, limit=float('inf'))
+    new_artist_ids = [artist_id for artist_id in artist_ids if artist_id not in hydrated]
+    new_artists = get_several_artists(token, new_artist_ids, strict=True)
+    checkpoint['artists'].extend(artist.id for artist in new_artists)
+    
+    save_releases_checkpoint(path, checkpoint)
+    print(f"Ingested {len(new_albums)} new albums and {len(new_artists)} new artists (checkpoint: {path})")
+    return new_albums, new_artists
+
+def ingest_releases_with_saved_token(markets, path=RELEASES_CHECKPOINT_FILE):
+    """Use the saved token to ingest new releases and display the newly seen artists"""
+    access_token = get_valid_token()
+    if not access_token:
+        return False
+    
+    import requests
+    try:
+        _, new_artists = ingest_new_releases(access_token, markets, path)
+    except requests.RequestException as e:
+        print(f"Ingest stopped: {e}. Nothing was marked as seen; run again to retry.")
+        return False
+    if new_artists:
+        display_artists({"items": new_artists})
+    return True
+
+def refresh_interval(popularity, viewed_at, now):
+    """Seconds between refreshes of an artist: popular and recently viewed ones come up more often"""
+    interval = REFRESH_INTERVAL
+    if (popularity or 0) >= REFRESH_POPULARITY:
+        interval /= 4
+    if viewed_at and now - viewed_at < REFRESH_RECENT_VIEW:
+        interval /= 4
+    return interval
+
+def due_artist_ids(store, now, limit):
+    """IDs of saved artists due for a refresh, most overdue (relative to their interval) first"""
+    overdue = []
+    for artist_id, popularity, viewed_at, refreshed_at in store.refresh_candidates():
+        lateness = (now - (refreshed_at or 0)) / refresh_interval(popularity, viewed_at, now)
+        if lateness >= 1:
+            overdue.append((lateness, artist_id))
+    overdue.sort(reverse=True)
+    return [artist_id for _, artist_id in overdue[:limit]]
+
+def refresh_due_artists(token, max_requests=REFRESH_BUDGET):
+    """Rehydrate the most overdue saved artists using at most max_requests batched requests.
+
+    Saved artists are split into fixed batches of ARTISTS_BATCH_SIZE consecutive
+    IDs, and whole batches are refreshed, the one with the most overdue artist
+    first. The same artists are thus requested together every time, so the
+    cache can revalidate a batch by ETag. Returns (refreshed, changed) counts.
+    """
+    store = get_artist_store()
+    now = time.time()
+    saved = sorted(row[0] for row in store.refresh_candidates())
+    due = due_artist_ids(store, now, len(saved))
+    if not due:
+        return 0, 0
+    batch_of = {artist_id: index // ARTISTS_BATCH_SIZE for index, artist_id in enumerate(saved)}
+    batches = sorted(list(dict.fromkeys(batch_of[a] for a in due if a in batch_of))[:max_requests])
+    # In batch order, so only the last (possibly short) batch can end early and the
+    # requests get_several_artists makes line up with the batches
+    artist_ids = [artist_id for batch in batches
+                  for artist_id in saved[batch * ARTISTS_BATCH_SIZE:(batch + 1) * ARTISTS_BATCH_SIZE]]
+    artists = get_several_artists(token, artist_ids, revalidate=True)
+    changed = sum(store.apply_refresh(artist, now) for artist in artists)
+    return len(artists), changed
+
+def refresh_artists_with_saved_token(budget=REFRESH_BUDGET, period=REFRESH_PERIOD, once=False):
+    """Keep saved artists fresh: every period seconds, refresh the most overdue ones within budget requests"""
+    print(f"Refreshing saved artists: up to {budget} requests every {period}s (Ctrl+C to stop)")
+    try:
+        while True:
+            cycle_started = time.time()
+            # Checked every cycle so an expiring token is renewed without anyone present
+            access_token = get_valid_token()
+            if access_token:
+                refreshed, changed = refresh_due_artists(access_token, budget)
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Refreshed {refreshed} artists, {changed} changed")
+            else:
+                print("No valid token; trying again next cycle")
+            if once:
+                return True
+            time.sleep(max(0, cycle_started + period - time.time()))
+    except KeyboardInterrupt:
+        print("\nStopped refreshing")
+        return True
+
 def get_playlists_with_saved_token():
     """Use the saved token to get and display user playlists"""
     access_token = get_valid_token()
     if not access_token:
         return False
     
-    # Get the user's playlists
-    playlists = get_user_playlists(access_token)
+    # Stream the user's playlists straight into the display
+    display_playlists(iter_user_playlists(access_token))
+    return True
+
+def export_playlists_with_saved_token(path, resume=True):
+    """Use the saved token to export the tracks of all user playlists"""
+    access_token = get_valid_token()
+    if not access_token:
+        return False
     
-    # Display the playlists
-    display_playlists(playlists)
+    import requests
+    try:
+        export_playlists(access_token, path, resume)
+    except (KeyboardInterrupt, requests.RequestException):
+        # The checkpoint has reported the error and saved the progress
+        return False
     return True
 
+class AsyncSpotifyClient:
+    """asyncio counterpart of the module-level functions, for use inside async services (needs aiohttp).
+
+    All calls share one aiohttp connection pool, retry like SpotifyClient, wait on
+    the shared rate limiter, accept a per-call timeout and can be cancelled.
+    Use it as `async with AsyncSpotifyClient() as client: ...`.
+    """
+
+    def __init__(self, pool_size=None, max_retries=None, timeout=None,
+                 backoff_factor=0.5, max_backoff=30):
+        import asyncio
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError("AsyncSpotifyClient needs aiohttp: pip install aiohttp") from None
+        self.pool_size = pool_size or POOL_SIZE
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.timeout = timeout or REQUEST_TIMEOUT
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.stats = RequestStats()
+        self.hooks = []
+        self._session = None
+        self._token_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        import aiohttp
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method, url, token=None, headers=None, timeout=None, **kwargs):
+        """Send a request and return (status, parsed JSON body).
+
+        Retries on rate limits, server errors and connection failures, and on a
+        401 refreshes the saved token and retries once.
+        """
+        if not url.startswith('http'):
+            url = f"{API_BASE_URL}{url}"
+        await self.open()
+        started = time.perf_counter()
+        info = {'retries': 0, 'bytes': 0}
+        status = 'error'
+        try:
+            status, data = await self._send(method, url, token, headers, timeout, kwargs, info)
+            if status == 401 and token:
+                new_token = await self.get_valid_token(stale_token=token)
+                if new_token and new_token != token:
+                    info['retries'] += 1
+                    status, data = await self._send(method, url, new_token, headers, timeout, kwargs, info)
+            return status, data
+        finally:
+            event = {
+                'method': method,
+                'endpoint': endpoint_template(url),
+                'status': status,
+                'latency': time.perf_counter() - started,
+                'bytes': info['bytes'],
+                'retries': info['retries'],
+                'cache': None,
+            }
+            self.stats.record(event)
+            for hook in self.hooks:
+                hook(event)
+
+    async def _send(self, method, url, token, headers, timeout, kwargs, info):
+        import asyncio
+        import aiohttp
+        all_headers = api_client.auth_headers(token) if token else {}
+        all_headers.update(headers or {})
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                info['retries'] += 1
+            if api_client.rate_limiter:
+                await api_client.rate_limiter.acquire_async()
+            try:
+                async with self._session.request(method, url, headers=all_headers,
+                                                 timeout=client_timeout, **kwargs) as response:
+                    body = await response.read()
+                    info['bytes'] += len(body)
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_delay(attempt, None, self.backoff_factor, self.max_backoff)
+                print(f"Request to {url} failed ({e!r}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                continue
+
+            if status not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return status, json.loads(body) if body else {}
+            delay = retry_delay(attempt, retry_after, self.backoff_factor, self.max_backoff)
+            print(f"Got status {status} from {url}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+    async def get(self, url, token=None, **kwargs):
+        return await self.request('GET', url, token, **kwargs)
+
+    async def refresh_token(self, refresh_token_str, timeout=None):
+        """Refresh the access token using the refresh token"""
+        data = {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token_str
+        }
+        _, token_data = await self.request('POST', TOKEN_URL, headers=api_client.basic_auth_headers(),
+                                           data=data, timeout=timeout)
+        return add_token_expiry(token_data)
+
+    async def get_valid_token(self, stale_token=None, timeout=None):
+        """Get a valid access token from TOKEN_FILE, refreshing it if needed (see get_valid_token)"""
+        async with self._token_lock:
+            token_data = load_token_data()
+            if token_data is None:
+                return None
+            if not token_needs_refresh(token_data, stale_token):
+                return token_data['access_token']
+            new_token_data = await self.refresh_token(token_data['refresh_token'], timeout)
+            return store_refreshed_token(token_data, new_token_data)
+
+    async def get_several_artists(self, token, artist_ids, timeout=None):
+        """Get full artist objects for a list of artist IDs, fetching all batches at once"""
+        import asyncio
+        chunks = [artist_ids[i:i + ARTISTS_BATCH_SIZE] for i in range(0, len(artist_ids), ARTISTS_BATCH_SIZE)]
+        responses = await asyncio.gather(*(
+            self.get("artists", token, params={'ids': ','.join(chunk)}, timeout=timeout) for chunk in chunks
+        ))
+        artists = []
+        for status, data in responses:
+            if status != 200:
+                print(f"Error getting artist details: {data}")
+                continue
+            artists.extend(Artist.from_json(a) for a in data.get('artists', []) if a)
+        return artists
+
+    async def get_popular_artists(self, token, limit=10, timeout=None):
+        """Get globally popular artists from new releases (see get_popular_artists)"""
+        status, data = await self.get("browse/new-releases", token,
+                                      params={'limit': 20, 'country': 'US'}, timeout=timeout)
+        if status != 200:
+            print(f"Error getting new releases: {data}")
+            return {"items": []}
+        albums = data.get('albums', {}).get('items', [])
+        artist_ids = collect_artist_ids(albums, limit)
+        return {"items": await self.get_several_artists(token, artist_ids, timeout)}
+
+    async def search_artist(self, token, query, policy='exact-or-popular', timeout=None):
+        """Search for an artist, pick a match with policy (see pick_artist_match) and add its details"""
+        import asyncio
+        status, data = await self.get("search", token, params={'q': query, 'type': 'artist', 'limit': 5},
+                                      timeout=timeout)
+        if status != 200:
+            print(f"Error searching for artist: {data}")
+            return None
+        candidates = [Artist.from_json(a) for a in data.get('artists', {}).get('items', []) if a]
+        artist = pick_artist_match(query, candidates, policy)
+        if artist is None:
+            return None
+        
+        artist_id = artist.id
+        (tracks_status, tracks), (related_status, related), (albums_status, albums) = await asyncio.gather(
+            self.get(f"artists/{artist_id}/top-tracks", token, params={'country': 'US'}, timeout=timeout),
+            self.get(f"artists/{artist_id}/related-artists", token, timeout=timeout),
+            self.get(f"artists/{artist_id}/albums", token, params={'limit': 10, 'include_groups': 'album'},
+                     timeout=timeout),
+        )
+        if tracks_status == 200:
+            artist.top_tracks = [Track.from_json(t) for t in tracks.get('tracks', [])[:5]]
+        if related_status == 200:
+            artist.related_artists = [Artist.from_json(a) for a in related.get('artists', [])]
+        elif related_status == 404:
+            artist.related_artists = None  # Not provided by Spotify for this artist
+        if albums_status == 200:
+            artist.albums = pick_top_albums(albums.get('items', []))
+        return artist
+
+    async def iter_user_playlists(self, token, max_items=None, offset=0, page_size=50, timeout=None):
+        """Yield the user's playlists one at a time, following 'next' links"""
+        url = "me/playlists"
+        params = {'limit': page_size, 'offset': offset}
+        count = 0
+        while url:
+            status, page = await self.get(url, token, params=params, timeout=timeout)
+            if status != 200:
+                print(f"Error getting playlists: {page}")
+                return
+            for playlist in page.get('items', []):
+                if max_items is not None and count >= max_items:
+                    return
+                if playlist is not None:
+                    yield Playlist.from_json(playlist)
+                    count += 1
+            url, params = page.get('next'), None
+
+    async def get_user_playlists(self, token, limit=None, timeout=None):
+        """Get the user's playlists (all of them, or at most limit)"""
+        return [p async for p in self.iter_user_playlists(token, max_items=limit, timeout=timeout)]
+
 def show_menu():
     """Show an interactive menu for the user"""
     while True:
@@ -567,40 +3117,168 @@ def show_menu():
         else:
             print("Invalid choice. Please try again.")
 
-def main():
-    # Check if we have command line arguments
-    import sys
+def report_cache_stats():
+    """Print how many API responses were served from the cache"""
+    cache = api_client.cache
+    if cache and (cache.hits or cache.misses):
+        print(f"\nCache: {cache.hits} hits, {cache.misses} misses")
+
+# Subcommands and their one-line help, in the order usage lists them
+COMMANDS = {
+    'auth': 'Get authorization URL',
+    'code': 'Process authorization code',
+    'artists': 'Get and display popular artists',
+    'playlists': 'Get and display your playlists',
+    'ingest-releases': 'Fetch only new releases since the last run',
+    'refresh': 'Keep saved artists up to date in the background',
+    'crawl': 'Crawl related artists from seed artist IDs',
+    'export-playlists': 'Export playlist tracks (.ndjson or .csv)',
+    'export-artists': 'Export saved artists, top tracks and albums as columnar tables',
+    'search': 'Search for an artist (saved ones first)',
+    'bulk-search': "Look up artist names/IDs from FILE ('-' for stdin)",
+    'menu': 'Show interactive menu',
+    'clear-cache': 'Empty the API response cache',
+}
+
+def comma_list(value):
+    return [item for item in value.split(',') if item]
+
+def build_parser():
+    """Command-line parser with one subcommand per step; the global options work before or after it"""
+    import argparse
+    # SUPPRESS keeps a subcommand's defaults from overwriting options given before it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--no-cache', action='store_true', default=argparse.SUPPRESS,
+                        help='bypass the API response cache')
+    common.add_argument('--stream', action='store_true', default=argparse.SUPPRESS,
+                        help='parse large paged responses incrementally')
+    common.add_argument('--stats', action='store_true', default=argparse.SUPPRESS,
+                        help='print API request timings at exit')
+    common.add_argument('--stats-json', metavar='FILE', default=argparse.SUPPRESS,
+                        help='write API request timings to FILE as JSON')
+    common.add_argument('--stats-prom', metavar='FILE', default=argparse.SUPPRESS,
+                        help='write API request timings to FILE in Prometheus text format')
+    
+    parser = argparse.ArgumentParser(prog='spotify_top_artists.py', parents=[common],
+                                     description='Explore Spotify artists and playlists.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands = {name: subparsers.add_parser(name, parents=[common], help=text, description=text)
+                for name, text in COMMANDS.items()}
+    
+    commands['code'].add_argument('auth_code', metavar='AUTH_CODE')
+    commands['artists'].add_argument('--markets', type=comma_list, metavar='US,GB,DE',
+                                     help='rank popular artists across several markets')
+    commands['ingest-releases'].add_argument('--markets', type=comma_list, default=['US'], metavar='US,GB')
+    commands['ingest-releases'].add_argument('--checkpoint', metavar='FILE', default=RELEASES_CHECKPOINT_FILE)
+    commands['refresh'].add_argument('--budget', type=int, default=REFRESH_BUDGET, metavar='N',
+                                     help='requests allowed per period (each covers up to 50 artists)')
+    commands['refresh'].add_argument('--period', type=float, default=REFRESH_PERIOD, metavar='SECONDS')
+    commands['refresh'].add_argument('--once', action='store_true', help='run a single cycle and exit')
+    commands['crawl'].add_argument('seeds', type=comma_list, metavar='SEED[,SEED...]')
+    commands['crawl'].add_argument('--depth', type=int, default=CRAWL_MAX_DEPTH)
+    commands['crawl'].add_argument('--max-nodes', type=int, default=CRAWL_MAX_NODES)
+    commands['crawl'].add_argument('--graph', metavar='FILE', default=GRAPH_FILE)
+    commands['export-playlists'].add_argument('file', nargs='?', default='playlists_export.ndjson')
+    commands['export-playlists'].add_argument('--restart', action='store_true',
+                                              help='ignore the checkpoint of an interrupted export')
+    commands['export-artists'].add_argument('directory', nargs='?', default=COLUMNAR_EXPORT_DIR, metavar='DIR')
+    commands['export-artists'].add_argument('--format', choices=COLUMNAR_FORMATS,
+                                            help='default: parquet when pyarrow is installed, else csv')
+    commands['export-artists'].add_argument('--full', action='store_true',
+                                            help='rewrite the export instead of appending changes')
+    commands['search'].add_argument('--remote', action='store_true', help='skip the saved artists')
+    commands['bulk-search'].add_argument('file', metavar='FILE')
+    commands['bulk-search'].add_argument('--output', metavar='OUT', default='-')
+    commands['bulk-search'].add_argument('--match', choices=MATCH_POLICIES, default='exact-or-popular')
+    commands['bulk-search'].add_argument('--rate', type=int, metavar='N',
+                                         help='requests per 30s for this run')
+    commands['bulk-search'].add_argument('--save', action='store_true',
+                                         help='also store the artists in the artist store')
+    commands['bulk-search'].add_argument('--restart', action='store_true',
+                                         help='ignore the checkpoint of an interrupted run')
+    return parser
+
+def upgrade_legacy_args(args):
+    """Rewrite the old '--search' style of commands so existing scripts keep working"""
+    if any(arg in COMMANDS for arg in args):
+        return args
+    for i, arg in enumerate(args):
+        if arg.startswith('--') and arg[2:] in COMMANDS:
+            return [arg[2:]] + args[:i] + args[i + 1:]
+    return args
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(upgrade_legacy_args(sys.argv[1:] if argv is None else list(argv)))
+    if not args.command:
+        # No command, show usage without loading anything else
+        parser.print_help()
+        return
+    
+    load_settings()
+    
+    # Global option: bypass the response cache for this run
+    if getattr(args, 'no_cache', False):
+        api_client.cache = None
     
-    if len(sys.argv) > 1 and sys.argv[1] == "--auth":
+    # Global option: decode large paged responses incrementally
+    if getattr(args, 'stream', False):
+        global STREAM_JSON
+        STREAM_JSON = True
+    
+    if args.command == "clear-cache":
+        # Empty the on-disk response cache
+        ResponseCache().clear()
+        print(f"Cleared response cache {CACHE_FILE}")
+    elif args.command == "auth":
         # Just show the authorization URL
         show_auth_url()
-    elif len(sys.argv) > 1 and sys.argv[1] == "--code" and len(sys.argv) > 2:
+    elif args.command == "code":
         # Process the authorization code
-        auth_code = sys.argv[2]
-        if process_auth_code(auth_code):
+        if process_auth_code(args.auth_code):
             # If authorization was successful, show the menu
             show_menu()
-    elif len(sys.argv) > 1 and sys.argv[1] == "--artists":
-        # Run the get popular artists step
-        get_popular_artists_with_saved_token()
-    elif len(sys.argv) > 1 and sys.argv[1] == "--playlists":
+    elif args.command == "artists":
+        # Run the get popular artists step, optionally across several markets
+        get_popular_artists_with_saved_token(args.markets)
+    elif args.command == "playlists":
         # Run the get playlists step
         get_playlists_with_saved_token()
-    elif len(sys.argv) > 1 and sys.argv[1] == "--search":
-        # Run the search artist step
-        search_artist_with_saved_token()
-    elif len(sys.argv) > 1 and sys.argv[1] == "--menu":
+    elif args.command == "export-playlists":
+        # Export all playlist tracks to NDJSON or CSV
+        export_playlists_with_saved_token(args.file, resume=not args.restart)
+    elif args.command == "export-artists":
+        # Append artists saved since the last export as columnar tables
+        export_saved_artists(args.directory, args.format, args.full)
+    elif args.command == "bulk-search":
+        # Look up many artists without prompting
+        bulk_search_with_saved_token(args.file, args.output, args.match, args.rate, save=args.save,
+                                     resume=not args.restart)
+    elif args.command == "crawl":
+        # Crawl the related-artists graph from comma-separated seed artists
+        crawl_with_saved_token(args.seeds, args.graph, args.depth, args.max_nodes)
+    elif args.command == "ingest-releases":
+        # Fetch only new releases not seen by earlier runs
+        ingest_releases_with_saved_token(args.markets, args.checkpoint)
+    elif args.command == "refresh":
+        # Refresh saved artists on a schedule until interrupted
+        refresh_artists_with_saved_token(args.budget, args.period, args.once)
+    elif args.command == "search":
+        # Run the search artist step (--remote skips the saved artists)
+        search_artist_with_saved_token(remote=args.remote)
+    elif args.command == "menu":
         # Show the interactive menu
         show_menu()
-    else:
-        # No arguments, show usage
-        print("Usage:")
-        print("  python spotify_top_artists.py --auth             # Get authorization URL")
-        print("  python spotify_top_artists.py --code AUTH_CODE  # Process authorization code")
-        print("  python spotify_top_artists.py --artists         # Get and display popular artists")
-        print("  python spotify_top_artists.py --playlists       # Get and display your playlists")
-        print("  python spotify_top_artists.py --search          # Search for an artist")
-        print("  python spotify_top_artists.py --menu            # Show interactive menu")
+    
+    report_cache_stats()
+    if getattr(args, 'stats', False):
+        api_client.stats.print_summary()
+    if getattr(args, 'stats_json', None):
+        with open(args.stats_json, "w") as f:
+            f.write(api_client.stats.to_json())
+    if getattr(args, 'stats_prom', None):
+        with open(args.stats_prom, "w") as f:
+            f.write(api_client.stats.to_prometheus())
 
 if __name__ == "__main__":
     main()
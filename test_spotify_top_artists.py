@@ -0,0 +1,137 @@
+"""Regression tests, run with `python -m unittest`. API calls go to benchmark.py's mock server."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+import spotify_top_artists as spotify
+
+
+class ResumableJobsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = benchmark.MockSpotify(playlist_count=2)
+        cls.server = benchmark.start_server(cls.mock)
+        spotify.api_client.cache = None
+        spotify.api_client.rate_limiter = None
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='spotify-test-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        spotify.TOKEN_FILE = os.path.join(self.workdir, 'access_token.json')
+        benchmark.write_token_file(spotify.TOKEN_FILE, expires_in=3600)
+
+    def test_checkpoint_ignores_output_of_unfinished_unit(self):
+        path = os.path.join(self.workdir, 'out.txt')
+        checkpoint_path = f"{path}.checkpoint"
+        with self.assertRaises(KeyboardInterrupt):
+            with spotify.JobCheckpoint(checkpoint_path, 'test', {}) as checkpoint, \
+                    checkpoint.open_output(path) as f:
+                f.write("p0-0\np0-1\n")
+                checkpoint.add('p0')
+                f.write("p1-0\n")
+                raise KeyboardInterrupt
+        with spotify.JobCheckpoint(checkpoint_path, 'test', {}) as checkpoint, \
+                checkpoint.open_output(path) as f:
+            self.assertEqual(checkpoint.done, {'p0'})
+            f.write("p1-0\np1-1\n")
+            checkpoint.add('p1')
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), "p0-0\np0-1\np1-0\np1-1\n")
+
+    def test_export_interrupted_mid_page_resumes_without_duplicates(self):
+        path = os.path.join(self.workdir, 'tracks.csv')
+        track_row = spotify.playlist_track_row
+
+        def interrupt_mid_page(playlist, position, item):
+            if position == 150:
+                raise KeyboardInterrupt
+            return track_row(playlist, position, item)
+
+        spotify.playlist_track_row = interrupt_mid_page
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                spotify.export_playlists('mock', path)
+        finally:
+            spotify.playlist_track_row = track_row
+        spotify.export_playlists('mock', path)
+
+        with open(path, encoding='utf-8') as f:
+            rows = f.read().splitlines()[1:]
+        self.assertEqual(len(rows), 500)
+        self.assertEqual(len(set(rows)), 500)
+        self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+    def test_crawl_resumed_with_larger_budget_expands_truncated_nodes(self):
+        path = os.path.join(self.workdir, 'graph.json')
+        seed = self.mock.artist_id(1)
+        spotify.crawl_related_artists('mock', [seed], max_depth=2, max_nodes=10, path=path)
+        self.assertIsNone(spotify.ArtistGraph.load(path).neighbors(seed))
+
+        graph = spotify.ArtistGraph.load(path)
+        spotify.crawl_related_artists('mock', [seed], max_depth=2, max_nodes=200, graph=graph, path=path)
+        self.assertEqual(len(spotify.ArtistGraph.load(path).neighbors(seed)), 20)
+
+
+class ArtistIndexTest(unittest.TestCase):
+
+    def test_reindexed_artist_is_found_by_new_name_only(self):
+        index = spotify.ArtistIndex([
+            {'id': 'a', 'name': 'Beyoncé', 'popularity': 90, 'genres': ['pop']},
+            {'id': 'b', 'name': 'Beyond', 'popularity': 50, 'genres': ['rock']},
+        ])
+        self.assertEqual([r['id'] for _, r in index.search('beyonce')][:1], ['a'])
+        index.add({'id': 'a', 'name': 'Solange', 'popularity': 80, 'genres': ['soul']})
+        self.assertNotIn('a', [r['id'] for _, r in index.search('beyonce')])
+        self.assertEqual([r['id'] for _, r in index.search('solange')], ['a'])
+
+    def test_common_trigrams_still_rank_name_matches_first(self):
+        records = [{'id': str(i), 'name': f"Artist {i}", 'popularity': i % 100, 'genres': ['pop']}
+                   for i in range(spotify.INDEX_MAX_POSTINGS * 3)]
+        records.append({'id': 'p', 'name': 'Pop', 'popularity': 1, 'genres': []})
+        index = spotify.ArtistIndex(records)
+        matches = index.search('pop')
+        self.assertEqual(matches[0][1]['id'], 'p')
+        self.assertEqual(len(matches), 5)
+
+
+class ChunkedResponse:
+    """Stand-in for a streamed requests response that delivers its body in fixed-size chunks"""
+
+    def __init__(self, body):
+        self.body = body.encode()
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class StreamedPageTest(unittest.TestCase):
+
+    def test_numbers_split_across_chunks(self):
+        body = '{"items":[12345,678,{"a":[1,2]},"x,]y"],"total":4}'
+        for chunk_size in (1, 3, 4, 64):
+            page = spotify.StreamedPage(ChunkedResponse(body), chunk_size=chunk_size)
+            self.assertEqual(list(page), [12345, 678, {'a': [1, 2]}, 'x,]y'])
+            self.assertEqual(page.meta, {'items': [], 'total': 4})
+
+    def test_truncated_body_raises_request_error(self):
+        import requests
+        page = spotify.StreamedPage(ChunkedResponse('{"items":[{"a":1},{"b"'), chunk_size=4)
+        with self.assertRaises(requests.RequestException):
+            list(page)
+
+
+if __name__ == '__main__':
+    unittest.main()